@@ -0,0 +1,113 @@
+'''
+Static properties of parsed rules.
+An extent is a tuple (read, least consumed, most consumed) counting stack
+cells from the top, None means the pattern is not statically bounded.
+A production is the least number of cells a RHS pattern pushes.
+'''
+from rule import Rule, LiteralString, FreeVar, Anything, CapturingChoice
+
+def is_pure(pattern, seen = None):
+    '''
+    True if matching pattern only depends on the stack it is given
+    '''
+    seen = set() if seen is None else seen
+    if id(pattern) in seen:
+        return True
+    seen.add(id(pattern))
+    for choice in pattern.choices:
+        if not getattr(choice, 'pure', True):
+            return False
+        if type(choice) is Rule and not all(is_pure(term, seen)
+                                             for term, *_ in choice.lhs):
+            return False
+    return True
+
+def lhs_extent(lhs, seen = frozenset()):
+    read, low, high = 0, 0, 0
+    for pattern, *_ in reversed(lhs):
+        term = extent(pattern, seen)
+        if term is None:
+            return None
+        term_read, term_low, term_high = term
+        read = max(read, high + term_read)
+        low, high = low + term_low, high + term_high
+    return (read, low, high)
+
+def extent(pattern, seen = frozenset()):
+    if id(pattern) in seen:
+        return None
+    seen = seen | {id(pattern)}
+    extents = []
+    for choice in pattern.choices:
+        if type(choice) in (LiteralString, FreeVar, Anything, CapturingChoice):
+            extents.append((1, 1, 1))
+        elif type(choice) is Rule:
+            extents.append(lhs_extent(choice.lhs, seen))
+        else:
+            extents.append(getattr(choice, 'extent', None))
+    if not extents or None in extents:
+        return None
+    reads, lows, highs = zip(*extents)
+    return (max(reads), min(lows), max(highs))
+
+def production(pattern, seen = frozenset()):
+    if type(pattern) in (LiteralString, FreeVar):
+        return 1
+    elif type(pattern) is Rule:
+        if id(pattern) in seen:
+            return None
+        return rhs_production(pattern.rhs, seen | {id(pattern)})
+    else:
+        return getattr(pattern, 'produces', None)
+
+def rhs_production(rhs, seen = frozenset()):
+    produced = [production(pattern, seen) for pattern, *_ in rhs]
+    return None if None in produced else sum(produced)
+
+class Unbounded(Exception):
+    pass
+
+def stream_window(rules):
+    '''
+    Returns the number of cells from the top that rules can still reach.
+    Raises Unbounded unless every rule reads a bounded part of the stack and
+    never leaves it shorter than it found it, since otherwise any cell could
+    be read again later.
+    '''
+    window = 0
+    for rule in rules:
+        rule_extent = lhs_extent(rule.lhs)
+        if rule_extent is None:
+            raise Unbounded(f'{rule} reads an unbounded part of the stack')
+        produced = rhs_production(rule.rhs)
+        if produced is None or produced < rule_extent[2]:
+            raise Unbounded(f'{rule} can shrink the stack')
+        window = max(window, rule_extent[0])
+    return window
+
+def has_effects(rhs, seen = frozenset()):
+    '''
+    True if applying rhs can do anything besides pushing onto the stack
+    '''
+    for pattern, *_ in rhs:
+        if type(pattern) is Rule:
+            if id(pattern) not in seen and has_effects(pattern.rhs,
+                                                       seen | {id(pattern)}):
+                return True
+        elif getattr(pattern, 'effects', False):
+            return True
+    return False
+
+def chunk_window(rules):
+    '''
+    Returns the stream window of rules if separately processed chunks of
+    input can be joined at their seams, raises Unbounded if not. On top of
+    the stream_window conditions, rules may not read or change any state
+    outside the stack.
+    '''
+    for rule in rules:
+        if not is_pure(rule):
+            raise Unbounded(f'{rule} reads global state')
+        if has_effects(rule.rhs):
+            raise Unbounded(f'{rule} has side effects')
+    return stream_window(rules)
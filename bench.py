@@ -0,0 +1,173 @@
+'''
+Benchmarks the engine on generated rule files and inputs.
+
+  python bench.py --sizes 10 100 1000 --tokens 50000 --save baseline.json
+  python bench.py --sizes 10 100 1000 --tokens 50000 --baseline baseline.json
+
+Every workload runs in a fresh process and reports parse and compile time,
+tokens and rule attempts per second, and peak memory. With --baseline,
+results that got worse by more than the tolerance are listed and the exit
+status is 1.
+'''
+from concurrent.futures import ProcessPoolExecutor
+import argparse, json, os, random, resource, sys, tempfile, time
+
+def literal_rules(size, tokens, rng):
+    rules = [f'X "k{i}" -> "v{i}" "w"' for i in range(size)]
+    words = [f'k{i}' for i in range(size)] + ['a', 'b', 'c']
+    return rules, [rng.choice(words) for _ in range(tokens)], ' '
+
+def labelled_rules(size, tokens, rng):
+    depth = max(size // 10, 1)
+    rules = ['d0: "x" X -> X "z"']
+    rules += [f'd{k}: d{k - 1}(A) "y" -> A "z"' for k in range(1, depth)]
+    rules += [f'd{depth - 1}(A) "go" -> A "done"']
+    rules += [f'X "f{i}" -> "g{i}" "w"' for i in range(size)]
+    input = []
+    while len(input) < tokens:
+        input += ['x', 'v', *(['y'] * (depth - 1)), 'go']
+        input += [rng.choice(['f0', 'q', 'y']) for _ in range(3)]
+    return rules, input[:tokens], ' '
+
+def choice_rules(size, tokens, rng):
+    rules = [f'a{i}: ' + ' | '.join(f'"w{i}_{j}"' for j in range(10))
+             for i in range(size)]
+    rules += [f'a{i}(A) a{(i + 1) % size}(B) -> "p{i}" "q"'
+              for i in range(size)]
+    words = [f'w{i}_{j}' for i in range(size) for j in range(10)]
+    return rules, [rng.choice(words) for _ in range(tokens)], ' '
+
+def arith_rules(size, tokens, rng):
+    rules = ['op: "+" | "-" | "*"',
+             'num: ' + ' | '.join(f'"{d}"' for d in range(10)),
+             'num(X) num(Y) op(Z) -> arith(X, Y, Z)']
+    rules += [f'X "k{i}" -> "v{i}" "w"' for i in range(size)]
+    input = [rng.choice(['1', '2', '3', '+', '-', '*', 'k0'])
+             for _ in range(tokens)]
+    return rules, input, ' '
+
+def regex_rules(size, tokens, rng):
+    rules = [f're(A) "m{i}" -> A "g{i}"' for i in range(size)]
+    input = []
+    while len(input) < tokens:
+        input += ['([a-z])[a-z]*', rng.choice(['abc', 'xyz', '123']),
+                  f'm{rng.randrange(size)}']
+    return rules, input[:tokens], ' '
+
+def list_rules(size, tokens, rng):
+    rules = ['clist(A, B) "csv" -> B A "pair"',
+             'X Y "mk" -> nlist(X, Y)',
+             'nlist(A, B) "un" -> A B "z"']
+    rules += [f'X "k{i}" -> "v{i}" "w"' for i in range(size)]
+    input = []
+    while len(input) < tokens:
+        input += rng.choice([['a;b;c', ';', 'csv'], ['p', 'q', 'mk', 'un'],
+                             [f'k{rng.randrange(size)}']])
+    return rules, input[:tokens], ' '
+
+def char_rules(size, tokens, rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    pairs = [(a, b) for a in letters for b in letters if a < b][:size]
+    rules = [f'"{a}" "{b}" -> "{b}" "{a}"' for a, b in pairs]
+    return rules, [rng.choice(letters + ' \n') for _ in range(tokens)], ''
+
+workloads = {'literal': literal_rules, 'labelled': labelled_rules,
+             'choice': choice_rules, 'arith': arith_rules,
+             're': regex_rules, 'lists': list_rules, 'char': char_rules}
+
+def measure(name, size, tokens, seed = 0):
+    from engine import Engine, token_generator
+    rules, input, seperator = workloads[name](size, tokens, random.Random(seed))
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'input')
+        with open(path, 'w') as infile:
+            infile.write(seperator.join(input))
+        start = time.perf_counter()
+        engine = Engine('\n'.join(rules))
+        parsed = time.perf_counter()
+        engine.prepare()
+        compiled = time.perf_counter()
+        with open(path) as infile:
+            engine.process(token_generator(infile, seperator))
+        elapsed = time.perf_counter() - compiled
+        profiler = engine.profile()
+        with open(path) as infile:
+            engine.process(token_generator(infile, seperator))
+    attempts = sum(stats.attempts + stats.nested
+                   for stats in profiler.stats.values())
+    # a builtin that never matches would only time failed attempts
+    from builtin import BuiltInRule
+    matched = set(stats.rule.name for stats in profiler.stats.values()
+                  if isinstance(stats.rule, BuiltInRule) and stats.matches)
+    idle = sorted(set(pattern.name for rule in engine.rules
+                      for pattern, *_ in rule.lhs
+                      if isinstance(pattern, BuiltInRule)) - matched)
+    if idle:
+        raise(Exception(f'{", ".join(idle)} never matched'))
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'parse_s': parsed - start, 'compile_s': compiled - parsed,
+            'tokens_per_s': len(input) / elapsed,
+            'attempts_per_s': attempts / elapsed,
+            'peak_kb': peak_rss - start_rss}
+
+def run_one(name, size, tokens):
+    with ProcessPoolExecutor(1) as pool:
+        try:
+            return pool.submit(measure, name, size, tokens).result()
+        except Exception as err:
+            return {'error': f'{type(err).__name__}: {err}'}
+
+# metric: True if higher is better
+metrics = {'parse_s': False, 'compile_s': False, 'tokens_per_s': True,
+           'attempts_per_s': True, 'peak_kb': False}
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for key, result in results.items():
+        old = baseline.get(key)
+        if not old or 'error' in old or 'error' in result:
+            continue
+        for metric, higher in metrics.items():
+            ratio = result[metric] / old[metric] if old[metric] else 1
+            if ratio < 1 - tolerance if higher else ratio > 1 + tolerance:
+                found.append(f'{key} {metric}: {old[metric]:.4g} -> ' +
+                             f'{result[metric]:.4g}')
+    return found
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark sessile')
+    parser.add_argument('--sizes', type = int, nargs = '+', default = [10, 100])
+    parser.add_argument('--tokens', type = int, default = 20000)
+    parser.add_argument('--only', nargs = '+', choices = list(workloads),
+                        default = list(workloads))
+    parser.add_argument('--baseline', type = argparse.FileType('r'))
+    parser.add_argument('--save', type = argparse.FileType('w'))
+    parser.add_argument('--tolerance', type = float, default = 0.15)
+    args = parser.parse_args(argv)
+    results = {}
+    print(f'{"workload":<16} {"parse ms":>9} {"compile ms":>10} ' +
+          f'{"tokens/s":>10} {"attempts/s":>11} {"peak kB":>9}')
+    for name in args.only:
+        for size in args.sizes:
+            key = f'{name}/{size}'
+            result = results[key] = run_one(name, size, args.tokens)
+            if 'error' in result:
+                print(f'{key:<16} {result["error"]}')
+                continue
+            print(f'{key:<16} {result["parse_s"] * 1000:>9.1f} ' +
+                  f'{result["compile_s"] * 1000:>10.1f} ' +
+                  f'{result["tokens_per_s"]:>10.0f} ' +
+                  f'{result["attempts_per_s"]:>11.0f} ' +
+                  f'{result["peak_kb"]:>9}')
+    if args.save:
+        json.dump(results, args.save, indent = 2)
+    if args.baseline:
+        found = regressions(results, json.load(args.baseline), args.tolerance)
+        for line in found:
+            print('regression:', line)
+        return 1 if found else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,13 +17,22 @@ get: LHS A matches term W and if W is a key, returns value A
 set: RHS K V sets V at key K
 del: RHS K removes value at K
 '''
-from rule import Rule, cons, car, cdr
+from rule import Rule, Effects, cons, car, cdr, take
 from overrides import overrides
+from tokens import as_int, as_float, as_rpn, evaluate, fullmatch
 import types, re
 
 class BuiltInRule(Rule):    
-    def __init__(self, name, arity = 0, match = None, apply = None):
+    def __init__(self, name, arity = 0, match = None, apply = None,
+                 pure = True, extent = None, produces = None, effects = False,
+                 accepts = None):
         self.name = name
+        self.accepts = accepts
+        self.choices = [self]
+        self.pure = pure
+        self.effects = effects
+        self.extent = extent
+        self.produces = produces
         if callable(arity):
             self.right_arity = types.MethodType(arity, self)
             self.arity = -1
@@ -34,9 +43,27 @@ class BuiltInRule(Rule):
         if apply:
             self.apply = types.MethodType(apply, self)
         
+    def copy(self):
+        '''
+        Returns a copy with choices of its own, so rules labelled with this
+        builtin's name only extend the copy
+        '''
+        rule = object.__new__(type(self))
+        rule.__dict__.update(self.__dict__)
+        for name in ('match', 'apply', 'right_arity'):
+            method = self.__dict__.get(name)
+            if method is not None:
+                setattr(rule, name, types.MethodType(method.__func__, rule))
+        rule.choices = [rule]
+        return rule
+
+    def __reduce__(self):
+        # the functions are found again by name, only the choices are kept
+        return (builtin_rule, (self.name,), {'choices': self.choices})
+
     def _str(self, args):
         if self.arity:
-            return f"{self.name}({', '.join(args)})"
+            return f"{self.name}({', '.join(str(arg) for arg in args)})"
         else:
             return self.name
 
@@ -49,41 +76,26 @@ class BuiltInRule(Rule):
 class UserInterrupt(Exception):
     pass
     
-class PrependCondition(Exception):
-    def __init__(self, stack, prepend):
-        self.stack = stack
-        self.prepend = prepend
-    
-def is_int(val):
-    try:
-        int(val)
-        return True
-    except:
-        return False
-
-def is_float(val):
-    try:
-        float(val)
-        return True
-    except:
-        return False
-
 def any_arity(self, _):
     return True
     
 def is_int_match(self, stack):
-    if is_int(car(stack)):
+    if stack and as_int(car(stack)) is not None:
         return ([car(stack)], cdr(stack))
     else:
         return None
-is_int = BuiltInRule(name = 'int', arity = 1, match = is_int_match)
+is_int = BuiltInRule(name = 'int', arity = 1, match = is_int_match,
+                     extent = (1, 1, 1),
+                     accepts = lambda token: as_int(token) is not None)
 
 def is_float_match(self, stack):
-    if is_float(car(stack)):
+    if stack and as_float(car(stack)) is not None:
         return ([car(stack)], cdr(stack))
     else:
         return None
-is_float = BuiltInRule(name = 'float', arity = 1, match = is_float_match)
+is_float = BuiltInRule(name = 'float', arity = 1, match = is_float_match,
+                       extent = (1, 1, 1),
+                       accepts = lambda token: as_float(token) is not None)
 
 def in_test_match(self, stack):
     try:
@@ -92,65 +104,60 @@ def in_test_match(self, stack):
         return ([first, second], rem)
     except:
         return None
-in_test = BuiltInRule(name = 'in', arity = 2, match = in_test_match)
+in_test = BuiltInRule(name = 'in', arity = 2, match = in_test_match,
+                      extent = (2, 2, 2))
 
 def concatenate(self, values, stack):
     return cons(''.join(values), stack)
-cat = BuiltInRule(name = 'cat', arity = any_arity, apply = concatenate)
+cat = BuiltInRule(name = 'cat', arity = any_arity, apply = concatenate,
+                  produces = 1)
 
 def arith_processor(f = False):
     import operator
+    number = as_float if f else as_int
+    fun = {'+': operator.add, '-': operator.sub, '*': operator.mul,
+           '/': (operator.truediv if f else operator.floordiv),
+           '%': operator.mod, '^': operator.pow}
     def eval_arith(self, values, stack):
-        try:
-            [expr] = values
-            ops = expr.split(' ')
-        except:
-            ops = values
+        expr = values[0] if len(values) == 1 else ' '.join(values)
+        result = evaluate(expr, f)
+        if result is not None:
+            return cons(result, stack)
         temp_stack = []
-        for op in ops:
-            try:
-                if f:
-                    temp_stack.append(float(op))
-                else:
-                    temp_stack.append(int(op))
-            except:
-                b, a = (int(temp_stack.pop()), int(temp_stack.pop()))
-                fun = {'+': operator.add, '-': operator.sub, '*': operator.mul,
-                       '/': (operator.truediv if f else operator.floordiv),
-                       '%': operator.mod, '^': operator.pow}
+        for op in (values if len(values) > 1 else expr.split(' ')):
+            value = number(op)
+            if value is not None:
+                temp_stack.append(value)
+            else:
+                b, a = temp_stack.pop(), temp_stack.pop()
+                if not f:
+                    a, b = int(a), int(b)
                 temp_stack.append(fun[op](a, b))
         return cons(str(temp_stack.pop()), stack)
     return eval_arith
 
 def arith_tester(f = False):
     def test_arith(self, stack):
-        try:
-            expr = car(stack)
-            elems = expr.split(' ')
-            count = 0
-            for elem in elems:
-                if f and is_float(elem) or is_int(elem):
-                    count += 1
-                elif elem in ['+', '-', '*', '/', '%' '^']:
-                    count -= 1
-                else:
-                    raise Exception('wut')
-                assert(count >= 1)
-            assert(count == 1)
-            return ([expr], cdr(stack))
-        except:
-            return None
+        if stack and as_rpn(car(stack), f) is not None:
+            return ([car(stack)], cdr(stack))
+        return None
     return test_arith
 arithmetic = BuiltInRule(name = 'arith', arity = any_arity, match = arith_tester(),
-                         apply = arith_processor())
+                         apply = arith_processor(), extent = (1, 1, 1),
+                         produces = 1,
+                         accepts = lambda token: as_rpn(token) is not None)
 float_arithmetic = BuiltInRule(name = 'arithf', arity = any_arity,
                                match = arith_tester(f = True),
-                               apply = arith_processor(f = True))
+                               apply = arith_processor(f = True),
+                               extent = (1, 1, 1), produces = 1,
+                               accepts = lambda token:
+                                   as_rpn(token, True) is not None)
 
 def output_top(self, values, stack):
     print(', '.join(values))
     return stack
-output = BuiltInRule(name = 'print', arity = 1, apply = output_top)
+output = BuiltInRule(name = 'print', arity = 1, apply = output_top,
+                     produces = 0, effects = True)
 
 def csv_split(self, stack):
     try:
@@ -164,10 +171,11 @@ def csv_join(self, values, stack):
     (*vals, char) = values
     return cons(char.join(vals), stack)
 csv_list = BuiltInRule(name = 'clist', arity = 2,
-                       match = csv_split, apply = csv_join)
+                       match = csv_split, apply = csv_join, extent = (2, 1, 1),
+                       produces = 1)
 
 def decode_tag(tag):
-    return int(re.fullmatch(r'\[([0-9]+)', tag).group(0))
+    return int(re.fullmatch(r'\[([0-9]+)', tag).group(1))
 def cfl_join(self, stack):
     try:
         ((char, tag), rest_stack) = take(2, stack)
@@ -193,44 +201,79 @@ def nls_dump(self, values, stack):
     stack = cons(tag, stack)
     return stack
 num_list = BuiltInRule('nlist', arity = 2,
-                       match = nls_join, apply = nls_dump)
+                       match = nls_join, apply = nls_dump, produces = 1,
+                       accepts = lambda token: token.startswith('['))
 
 def regex_group(self, stack):
-        try:
-            ((regex, target), rest) = take(2, stack)
-            match = re.fullmatch(regex, target)
-            assert(match)
-            return (match.groups, rest)
-        except:
-            return None
-regex_bypass = BuiltInRule(name = 're', arity = any_arity, match = regex_group)
+    try:
+        ((regex, target), rest) = take(2, stack)
+    except:
+        return None
+    groups = fullmatch(regex, target, self.patterns)
+    return None if groups is None else (list(groups), rest)
+regex_bypass = BuiltInRule(name = 're', arity = any_arity, match = regex_group,
+                           extent = (2, 2, 2))
+regex_bypass.patterns = None
 
 def stop_and_print(self, _, stack):
-    raise UserInterrupt(*reveresed(flatten(stack)))
-user_stop = BuiltInRule(name = 'stop', apply = stop_and_print)
+    return Effects(stack, halt = True)
+user_stop = BuiltInRule(name = 'stop', apply = stop_and_print, effects = True)
 
 def prepend_ls(self, list, stack):
-    raise PrependCondition(stack, list)
-prepend = BuiltInRule(name = 'prepend', arity = any_arity, apply = prepend_ls)
+    return Effects(stack, list)
+prepend = BuiltInRule(name = 'prepend', arity = any_arity, apply = prepend_ls,
+                      produces = 0, effects = True)
 
-global_state = {}
-def reset_state():
-    global_state = {}
 def global_lookup(self, stack):
     try:
-        return ([global_state[car(stack)]], cdr(stack))
+        return ([self.state[car(stack)]], cdr(stack))
     except:
         return None
-global_get = BuiltInRule(name = 'get', arity = 1, match = global_lookup)
+global_get = BuiltInRule(name = 'get', arity = 1, match = global_lookup,
+                         pure = False, extent = (1, 1, 1))
 def global_assign(self, pair, stack):
     key, value = pair
-    global_state[key] = value
-global_set = BuiltInRule(name = 'set', arity = 2, apply = global_assign)
+    self.state[key] = value
+    return stack
+global_set = BuiltInRule(name = 'set', arity = 2, apply = global_assign,
+                         produces = 0, effects = True)
 def global_retract(self, key, stack):
     [key] = key
-    del global_state[key]
-global_del = BuiltInRule(name = 'del', arity = 1, apply = global_retract)
+    del self.state[key]
+    return stack
+global_del = BuiltInRule(name = 'del', arity = 1, apply = global_retract,
+                         produces = 0, effects = True)
+global_state = {}
+for fun in (global_get, global_set, global_del):
+    fun.state = global_state
 funs = [is_int, is_float, in_test, cat, arithmetic, float_arithmetic, output,
         csv_list, csv_from_nlist, num_list, regex_bypass, user_stop, prepend,
         global_get, global_set, global_del]
 default_named = dict((fun.name, [fun]) for fun in funs)
+
+def rule_table(state = None, patterns = None):
+    '''
+    Returns a new rule table holding copies of the builtins, labelled rules
+    of one table never reach another. See bind for state and patterns.
+    '''
+    named_rules = dict((fun.name, [fun.copy()]) for fun in funs)
+    return bind(named_rules, {} if state is None else state, patterns)
+
+def bind(named_rules, state, patterns = None):
+    '''
+    Makes get, set and del in named_rules keep their values in state, and
+    re compile its patterns into the tokens.TokenCache patterns, the one
+    shared by the process if None. Returns named_rules.
+    '''
+    for name in ('get', 'set', 'del', 're'):
+        for rule in named_rules.get(name, ()):
+            if not isinstance(rule, BuiltInRule):
+                continue
+            if name == 're':
+                rule.patterns = patterns
+            else:
+                rule.state = state
+    return named_rules
+
+def builtin_rule(name):
+    return default_named[name][0].copy()
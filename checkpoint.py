@@ -0,0 +1,167 @@
+'''
+Checkpoints of a batch job over several infiles, to resume it after a crash.
+A checkpoint holds the stack, the tokens prepended to the input and not yet
+read, the state of the get and set builtins, and the position in the input
+as the number of the infile and the tokens read from it.
+
+The checkpoint file is a log. It starts with a header naming the job and a
+full copy of the stack, and every later record only holds the cells above
+the part of the stack that was already written. Which part that is comes
+from anchors, cells remembered every spacing cells deep, so finding it only
+walks the cells that changed. The log is rewritten from scratch once it
+holds more than twice the cells of the stack. Array stacks make new cells
+whenever they are walked, so they are always written in full.
+'''
+from time import monotonic
+import os, pickle
+
+version = 1
+
+class Checkpointer(object):
+    def __init__(self, path, job, interval = 60.0, every = 4096,
+                 spacing = 4096, state = None):
+        '''
+        job identifies the run, a checkpoint of another job isn't resumed.
+        The engine asks every every tokens if interval seconds have passed.
+        state is the dict the get and set builtins keep their values in.
+        '''
+        self.path = path
+        self.state = {} if state is None else state
+        self.job = job
+        self.interval = interval
+        self.every = every
+        self.spacing = spacing
+        self.file = 0
+        self.offset = 0
+        self.log = None
+        self.logged = 0
+        self.anchors = {}
+        self.chain = []
+        self.top = None
+        self.due = monotonic() + interval
+
+    def reading(self, file, offset = 0):
+        '''
+        Input now comes from infile number file, offset tokens into it
+        '''
+        self.file = file
+        self.offset = offset
+
+    def tick(self, stack, input):
+        '''
+        Saves if the last save is interval seconds old, called by the
+        engine after reading a token
+        '''
+        if monotonic() >= self.due:
+            self.save(stack, input.but_first, self.file,
+                      self.offset + input.read)
+
+    def finished(self, file, stack):
+        '''
+        Saves once infile number file has been read to the end
+        '''
+        self.save(stack, (), file + 1, 0)
+
+    def save(self, stack, pending, file, cursor):
+        nodes, depth, base = self._walk(stack)
+        size = depth + len(nodes)
+        if self.log is None or self.logged + len(nodes) > 2 * size + self.spacing:
+            self._restart()
+            nodes, depth, base = self._walk(stack)
+        heads = [node[0] for node in reversed(nodes)]
+        pickle.dump((depth, heads, list(pending), dict(self.state), file,
+                     cursor), self.log, pickle.HIGHEST_PROTOCOL)
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        if self.log.name != self.path:
+            self.log.close()
+            os.replace(self.log.name, self.path)
+            self.log = open(self.path, 'ab')
+        self.logged += len(heads)
+        self._anchor(nodes, depth, base)
+        self.due = monotonic() + self.interval
+
+    def _walk(self, stack):
+        '''
+        Cells above the part of stack already written, top first, the
+        number of cells in that part and its top cell
+        '''
+        nodes = []
+        anchors = self.anchors
+        top = self.top
+        while stack:
+            if top is not None and stack is top[0]:
+                return nodes, top[1], stack
+            anchor = anchors.get(id(stack))
+            if anchor is not None and anchor[0] is stack:
+                return nodes, anchor[1], stack
+            nodes.append(stack)
+            _, stack = stack
+        return nodes, 0, None
+
+    def _anchor(self, nodes, depth, base):
+        # anchors above depth are cells the log has since dropped
+        chain = self.chain
+        while chain and chain[-1][1] > depth:
+            node, _ = chain.pop()
+            del self.anchors[id(node)]
+        size = depth + len(nodes)
+        for node in reversed(nodes):
+            depth += 1
+            if depth % self.spacing == 0:
+                chain.append((node, depth))
+                self.anchors[id(node)] = (node, depth)
+        top = nodes[0] if nodes else base
+        self.top = (top, size) if size else None
+
+    def _restart(self):
+        if self.log is not None:
+            self.log.close()
+        self.anchors = {}
+        self.chain = []
+        self.top = None
+        self.logged = 0
+        self.log = open(self.path + '.tmp', 'wb')
+        pickle.dump((version, self.job), self.log, pickle.HIGHEST_PROTOCOL)
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+    def remove(self):
+        '''
+        Drops the checkpoint once the job is done
+        '''
+        self.close()
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def load(self):
+        '''
+        Returns the last checkpoint of this job as (cells, pending,
+        state, file, cursor), None if there is none. cells are the
+        stack bottom first. A record cut short by a crash is ignored.
+        '''
+        try:
+            log = open(self.path, 'rb')
+        except FileNotFoundError:
+            return None
+        cells = []
+        last = None
+        with log:
+            try:
+                if pickle.load(log) != (version, self.job):
+                    return None
+                while True:
+                    depth, heads, *rest = pickle.load(log)
+                    del cells[depth:]
+                    cells += heads
+                    last = rest
+            except Exception:
+                pass
+        if last is None:
+            return None
+        pending, state, file, cursor = last
+        return cells, pending, state, file, cursor
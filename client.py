@@ -0,0 +1,54 @@
+'''
+Sends lines to a sessile server and prints what comes back.
+
+  python client.py localhost:7777 < tokens.txt
+  python client.py /tmp/sessile.sock
+
+Reads stdin until it ends, then waits for the server to send the stack.
+'''
+import argparse, asyncio, sys
+
+async def connect(address):
+    host, _, port = address.rpartition(':')
+    if port.isdigit():
+        return await asyncio.open_connection(host or None, int(port))
+    return await asyncio.open_unix_connection(address)
+
+async def talk(address, infile):
+    reader, writer = await connect(address)
+    loop = asyncio.get_running_loop()
+    async def send():
+        try:
+            while True:
+                # read on a thread so replies show up while waiting for input
+                line = await loop.run_in_executor(None, infile.readline)
+                if not line:
+                    break
+                writer.write(line.encode())
+                await writer.drain()
+            if writer.can_write_eof():
+                writer.write_eof()
+        except ConnectionError:
+            # the server stopped the session early
+            pass
+    async def receive():
+        while True:
+            data = await reader.read(1 << 16)
+            if not data:
+                return
+            sys.stdout.write(data.decode())
+            sys.stdout.flush()
+    sending = asyncio.ensure_future(send())
+    await receive()
+    if not sending.done():
+        sending.cancel()
+    writer.close()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Talk to a sessile server')
+    parser.add_argument('address', help = 'HOST:PORT or a Unix socket path')
+    args = parser.parse_args(argv)
+    asyncio.run(talk(args.address, sys.stdin))
+
+if __name__ == '__main__':
+    main()
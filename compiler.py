@@ -0,0 +1,164 @@
+'''
+Compiles rules into straight-line python matchers and appliers.
+Strings, free variables and capturing choices are tested inline, only
+patterns with more than one choice backtrack.
+The compiled functions replace match and apply on the rule instance, so
+Rule.match and Rule.apply remain available as the reference interpreter.
+'''
+from rule import (Rule, LiteralString, FreeVar, Anything, CapturingChoice,
+                  Effects, _bound)
+from linked_list import cons
+from analysis import has_effects
+
+_inline = (LiteralString, FreeVar, Anything, CapturingChoice)
+
+class _Source(object):
+    def __init__(self, header):
+        self.lines = [header]
+        self.consts = {}
+        self.indent = 1
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def const(self, value):
+        name = f'K{len(self.consts)}'
+        self.consts[name] = value
+        return name
+
+    def build(self, name, filename):
+        code = compile('\n'.join(self.lines), filename, 'exec')
+        namespace = dict(self.consts)
+        exec(code, namespace)
+        return namespace[name]
+
+def _filename(rule):
+    return f'<rule {rule.label}>' if rule.label else '<rule>'
+
+def compile_match(rule):
+    '''
+    Returns a function equivalent to rule.match, or None if the rule
+    can't be compiled
+    '''
+    if not rule.lhs:
+        return None
+    src = _Source('def match(stack):')
+    names = dict((var, src.const(var.value)) for var in _bound(rule.rhs_names))
+    fail = 'return None'
+    stack = 'stack'
+    for i, (pattern, *vars) in enumerate(reversed(rule.lhs)):
+        if not pattern.choices:
+            return None
+        new_stack = f's{i}'
+        if pattern.choices == [pattern] and type(pattern) in _inline:
+            results = ['h'] if type(pattern) is not Anything else []
+            src.emit(f'if not {stack}: {fail}')
+            if type(pattern) is Anything:
+                src.emit(f'{new_stack} = {stack}[1]')
+            else:
+                src.emit(f'h, {new_stack} = {stack}')
+            if type(pattern) is LiteralString:
+                src.emit(f'if h != {src.const(pattern.text)}: {fail}')
+                results = []
+            elif type(pattern) is CapturingChoice:
+                terminals = src.const(pattern.terminal_set)
+                src.emit(f'if h not in {terminals}: {fail}')
+        else:
+            if len(pattern.choices) > 1:
+                src.emit(f'for c{i} in {src.const(tuple(pattern.choices))}:')
+                src.indent += 1
+                fail = 'continue'
+                src.emit(f'm{i} = c{i}.match({stack})')
+            else:
+                choice = src.const(pattern.choices[0])
+                src.emit(f'm{i} = {choice}.match({stack})')
+            src.emit(f'if not m{i}: {fail}')
+            src.emit(f'r{i}, {new_stack} = m{i}')
+            if len(vars) > 1:
+                # short results bind only some variables, which the
+                # interpreter handles
+                interpret = src.const(Rule.match)
+                src.emit(f'if len(r{i}) < {len(vars)}: ' +
+                         f'return {interpret}({src.const(rule)}, stack)')
+            results = [f'r{i}[{j}]' for j in range(len(vars))]
+        if len(vars) == 1:
+            bindings = {vars[0]: results[0]} if results else {}
+        else:
+            bindings = dict(zip(vars, results))
+        for var, value in bindings.items():
+            if var in names:
+                src.emit(f'if {value} != {names[var]}: {fail}')
+            else:
+                names[var] = f'v{len(names)}'
+                src.emit(f'{names[var]} = {value}')
+        stack = new_stack
+    if not all(name in names for name in rule.rhs_param):
+        return None
+    values = ', '.join(names[name] for name in rule.rhs_param)
+    src.emit(f'return ([{values}], {stack})')
+    return src.build('match', _filename(rule))
+
+def compile_apply(rule, inline_cons = True):
+    '''
+    Returns a function equivalent to rule.apply, or None if the rule
+    can't be compiled. Unless inline_cons is set, pushes go through
+    linked_list.cons rather than building tuples. Only terms that can
+    have effects are checked for them.
+    '''
+    src = _Source('def apply(values, stack):')
+    conser = None if inline_cons else src.const(cons)
+    def push(value):
+        if conser is None:
+            return f'stack = ({value}, stack)'
+        return f'stack = {conser}({value}, stack)'
+    names = dict((var, src.const(var.value)) for var in _bound(rule.rhs_names))
+    for j, name in enumerate(rule.rhs_param):
+        names[name] = f'v{j}'
+        src.emit(f'v{j} = values[{j}]')
+    if not all(var in names for _, *vars in rule.rhs for var in vars):
+        return None
+    effects = has_effects(rule.rhs)
+    if effects:
+        src.emit('effects = None')
+    for pattern, *vars in rule.rhs:
+        target = src.const(pattern)
+        if type(pattern) is LiteralString:
+            src.emit(push(src.const(pattern.text)))
+        elif len(vars) == 1:
+            value = names[vars[0]]
+            src.emit(f'if isinstance({value}, (tuple, list)):')
+            src.emit(f'    stack = {target}.apply({value}, stack)')
+            src.emit('else:')
+            if type(pattern) is FreeVar:
+                src.emit('    ' + push(value))
+            else:
+                src.emit(f'    stack = {target}.apply([{value}], stack)')
+        else:
+            values = ', '.join(names[var] for var in vars)
+            src.emit(f'stack = {target}.apply([{values}], stack)')
+        if effects and has_effects([(pattern, *vars)]):
+            src.emit(f'if stack.__class__ is {src.const(Effects)}:')
+            src.emit('    effects = stack.after(effects)')
+            src.emit('    stack = stack.stack')
+    if effects:
+        src.emit('if effects is not None:')
+        src.emit('    effects.stack = stack')
+        src.emit('    return effects')
+    src.emit('return stack')
+    return src.build('apply', _filename(rule))
+
+def compile_rules(rules, named_rules, inline_cons = True):
+    '''
+    Replaces match and apply of every rule reachable from rules and
+    named_rules with compiled versions
+    '''
+    seen = set()
+    for rule in [*rules, *(r for ls in named_rules.values() for r in ls)]:
+        if type(rule) is not Rule or id(rule) in seen:
+            continue
+        seen.add(id(rule))
+        match, apply = compile_match(rule), compile_apply(rule, inline_cons)
+        if match:
+            rule.match = match
+        if apply:
+            rule.apply = apply
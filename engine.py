@@ -0,0 +1,503 @@
+'''
+Embeddable sessile runtime.
+An Engine loads and compiles rule files once and then runs any number of
+independent inputs against them. Importing this module is cheap, the
+parser, the builtins and their dependencies are only imported once rules
+are loaded.
+'''
+from linked_list import ArrayStack, Conser, cons, flatten, take, empty_like, \
+        segments
+from collections import OrderedDict, deque
+from sys import intern
+
+class Engine(object):
+    def __init__(self, *sources, interpret = False, memo = None,
+                 stack = 'tuple', regex_cache = None, cache_dir = None,
+                 loop_window = None):
+        '''
+        sources are rule texts, or (text, name) pairs. stack is either
+        'tuple' for cons cells or 'array' for linked_list.ArrayStack. With
+        a loop_window, a run that comes back to a stack it had since reading
+        its last token raises RewriteLoop, see LoopDetector.
+        regex_cache gives the re builtin a compiled pattern cache of that
+        size of its own, instead of the one shared by the process. get and
+        set keep their values in state, one dict per engine. With a
+        cache_dir, sources
+        are only parsed when the rules are first needed, and the parsed
+        rules are cached there, see rulecache.
+        '''
+        self.interpret = interpret
+        self.cache_dir = cache_dir
+        self.pending = False
+        self.stack = stack
+        self.regex_cache = regex_cache
+        self.patterns = None
+        if regex_cache:
+            from tokens import TokenCache
+            self.patterns = TokenCache(size = regex_cache, name = 'regex')
+        self.state = {}
+        self.memo_size = memo
+        self.memo = None
+        self.named_rules = None
+        self.rules = []
+        self.sources = []
+        self.index = None
+        self.observer = None
+        self.metrics = None
+        self.checkpointer = None
+        self.halted = False
+        if loop_window and stack == 'array':
+            raise(Exception('loop detection needs tuple stacks'))
+        self.loop_window = loop_window
+        for source in sources:
+            if isinstance(source, str):
+                self.load(source)
+            else:
+                self.load(*source)
+
+    def __getstate__(self):
+        # compiled rules can't be pickled, so copies load the sources again
+        return {'sources': self.sources, 'interpret': self.interpret,
+                'memo': self.memo_size, 'stack': self.stack,
+                'regex_cache': self.regex_cache, 'cache_dir': self.cache_dir,
+                'loop_window': self.loop_window}
+
+    def __setstate__(self, state):
+        self.__init__(*state['sources'], interpret = state['interpret'],
+                      memo = state['memo'], stack = state['stack'],
+                      regex_cache = state['regex_cache'],
+                      cache_dir = state['cache_dir'],
+                      loop_window = state['loop_window'])
+
+    def load(self, text, name = None):
+        '''
+        Parses the rules in text into this engine's own rule table, name is
+        recorded as the origin of the rules
+        '''
+        from parser import parse_rules
+        if self.index:
+            raise(Exception('rules already compiled'))
+        self.sources.append((text, name))
+        if self.cache_dir:
+            self.pending = True
+            return self
+        self.named_rules, new_rules = parse_rules(text, self.table(), name)
+        self.rules += new_rules
+        return self
+
+    def parsed(self):
+        '''
+        Parses sources whose parsing was put off for the cache
+        '''
+        if self.pending:
+            from rulecache import load_rules
+            from builtin import bind
+            self.named_rules, self.rules = load_rules(self.sources,
+                                                      self.cache_dir)
+            bind(self.named_rules, self.state, self.patterns)
+            self.pending = False
+        return self
+
+    def table(self):
+        '''
+        Returns the rule table, starting out as a copy of the builtins
+        '''
+        if self.named_rules is None:
+            from builtin import rule_table
+            self.named_rules = rule_table(self.state, self.patterns)
+        return self.named_rules
+
+    def prepare(self):
+        '''
+        Compiles the loaded rules, done once before the first run
+        '''
+        if self.index is None:
+            from index import RuleIndex
+            from compiler import compile_rules
+            from memo import MatchMemo
+            self.parsed().table()
+            if not self.interpret:
+                compile_rules(self.rules, self.named_rules,
+                              inline_cons = self.stack == 'tuple')
+            if self.memo_size:
+                self.memo = MatchMemo(self.memo_size)
+                self.memo.install(self.named_rules)
+            self.index = RuleIndex(self.rules)
+        return self.index
+
+    def reset(self):
+        '''
+        Clears the state builtins keep between inputs
+        '''
+        self.state.clear()
+
+    def use_state(self, state):
+        '''
+        Makes get, set and del keep their values in the dict state from now
+        on, so callers taking turns on one engine can each keep their own
+        '''
+        from builtin import bind
+        self.state = state
+        bind(self.parsed().table(), state, self.patterns)
+
+    def empty(self):
+        return ArrayStack() if self.stack == 'array' else None
+
+    def run(self, tokens, stack = None, stream = None, pending = None):
+        '''
+        Runs tokens on top of stack, returns the resulting stack. halted
+        tells if a rule stopped the run before the end of tokens. pending
+        are prepended tokens left over from a checkpoint.
+        '''
+        index = self.prepare()
+        if stack is None:
+            stack = self.empty()
+        input = PrependableGenerator(iter(tokens))
+        if pending:
+            input.but_first = list(pending)
+        if self.metrics is not None:
+            self.metrics.input = input
+        stack = run(self.named_rules, self.rules, stack, input, index, stream,
+                    self.observer, self.loop_window,
+                    self.checkpointer)
+        self.halted = input.halted
+        return stack
+
+    def process(self, *inputs, stream = None):
+        '''
+        Runs inputs in order as one job, starting from an empty stack and
+        fresh builtin state
+        '''
+        self.reset()
+        stack = None
+        for tokens in inputs:
+            stack = self.run(tokens, stack, stream)
+            if self.halted:
+                break
+        return stack
+
+    def interactive(self, seperator = ' '):
+        index = self.prepare()
+        run_interactive(self.named_rules, self.rules, seperator, index,
+                        self.empty())
+
+    def stream_writer(self, outfile, seperator, chunk = 1 << 16):
+        '''
+        Returns a FrozenWriter for outfile, raises analysis.Unbounded if
+        the rules can't be streamed
+        '''
+        from analysis import stream_window
+        self.parsed()
+        return FrozenWriter(outfile, seperator, stream_window(self.rules),
+                            chunk = chunk)
+
+    def profile(self):
+        '''
+        Installs and returns a profiler.Profiler on all rules
+        '''
+        from profiler import Profiler
+        self.prepare()
+        self.observer = Profiler()
+        self.observer.install(self.rules, self.named_rules)
+        return self.observer
+
+    def monitor(self):
+        '''
+        Installs and returns a metrics.Metrics following every run, on top
+        of any profiler installed before
+        '''
+        from metrics import Metrics
+        self.metrics = self.observer = Metrics(self.observer)
+        return self.metrics
+
+    def checkpoint(self, path, infiles, seperator, interval = 60.0):
+        '''
+        Installs and returns a checkpoint.Checkpointer saving to path every
+        interval seconds, for a job running these rules over infiles
+        '''
+        from checkpoint import Checkpointer
+        from rulecache import cache_key
+        job = (cache_key(self.sources), tuple(infiles), seperator)
+        self.checkpointer = Checkpointer(path, job, interval,
+                                         state = self.state)
+        return self.checkpointer
+
+    def resume(self):
+        '''
+        Restores builtin state from the last checkpoint, returns the stack,
+        the number of the infile, the tokens already read from it and the
+        pending prepended tokens, or None if there is no checkpoint
+        '''
+        saved = self.checkpointer.load()
+        if saved is None:
+            return None
+        cells, pending, state, file, cursor = saved
+        self.state.clear()
+        self.state.update(state)
+        stack = self.empty()
+        for cell in cells:
+            stack = cons(cell, stack)
+        return stack, file, cursor, pending
+
+    def chunk_window(self):
+        '''
+        Returns the window parallel.run_chunked needs, raises
+        analysis.Unbounded if input can't be split for these rules
+        '''
+        from analysis import chunk_window
+        return chunk_window(self.parsed().rules)
+
+def run(named_rules, rules, stack, input, index = None, stream = None,
+        observer = None, loop_window = None,
+        checkpoint = None, budget = None):
+    '''
+    Applies rules to stack and reads input until neither is left. With a
+    budget, returns once input.steps, counting applications and tokens
+    read, reaches it, setting input.paused so the caller can go on later.
+    '''
+    from builtin import UserInterrupt
+    from rule import Effects
+    if index is None:
+        from index import RuleIndex
+        index = RuleIndex(rules)
+    settled = SettledStacks() if index.pure else None
+    loops = None
+    if loop_window:
+        if not index.pure:
+            raise(Exception('loop detection needs rules that never read ' +
+                            'builtin state with get'))
+        loops = LoopDetector(loop_window)
+        loops.pushed(stack)
+    inert = index.inert
+    pushed = 0
+    while True:
+        match = None
+        if settled is None or stack not in settled:
+            for rule in index.candidates(stack):
+                match = rule.match(stack)
+                if match:
+                    break
+        if match:
+            args, res_stack = match
+            old_stack = stack
+            stack = rule.apply(args, res_stack)
+            effects = None
+            if stack.__class__ is Effects:
+                effects, stack = stack, stack.stack
+                if effects.prepend:
+                    input.prepend(effects.prepend)
+            if loops is not None:
+                if effects is not None and effects.prepend:
+                    loops.pushed(stack)
+                else:
+                    stack = loops.applied(rule, stack, res_stack)
+            if observer is not None:
+                observer.applied(rule, old_stack, res_stack, stack)
+            if effects is not None and effects.halt:
+                input.halted = True
+                return stack
+            if budget is not None:
+                input.steps += 1
+                if input.steps >= budget:
+                    input.paused = True
+                    return stack
+            continue
+        if settled is not None:
+            settled.add(stack)
+        try:
+            while True:
+                token = next(input, _end)
+                if token is _end:
+                    return stack
+                stack = cons(token, stack)
+                pushed += 1
+                if observer is not None:
+                    observer.pushed(stack)
+                if stream and pushed % stream.every == 0:
+                    stack = stream.flush(stack)
+                if loops is not None:
+                    loops.pushed(stack)
+                if checkpoint and pushed % checkpoint.every == 0:
+                    checkpoint.tick(stack, input)
+                if budget is not None:
+                    input.steps += 1
+                    if input.steps >= budget:
+                        input.paused = True
+                        return stack
+                if inert is None or not inert(token):
+                    break
+        except KeyboardInterrupt:
+            raise UserInterrupt(*reversed(flatten(stack)))
+
+_end = object()
+
+def run_batch(named_rules, rules, stack, input, index = None, stream = None):
+    stack = run(named_rules, rules, stack, input, index, stream)
+    return stack
+
+def run_interactive(named_rules, rules, seperator, index = None,
+                    stack = None):
+    from builtin import UserInterrupt
+    input = PrependableGenerator(input_generator(seperator))
+    try:
+        stack = run(named_rules, rules, stack, input, index)
+        print('[' + ', '.join(reversed(flatten(stack))) + ']')
+    except UserInterrupt as err:
+        print('[' + ', '.join(err.args) + ']')
+
+class SettledStacks():
+    '''
+    Recently seen stacks on which no rule matched. Matching only looks at
+    the stack, so when an application leaves one of these on top there is
+    nothing to retry before reading more input.
+    '''
+    def __init__(self, size = 256):
+        self.size = size
+        self.stacks = OrderedDict()
+
+    def add(self, stack):
+        self.stacks[id(stack)] = stack
+        if len(self.stacks) > self.size:
+            self.stacks.popitem(last = False)
+
+    def __contains__(self, stack):
+        key = id(stack)
+        return key in self.stacks and self.stacks[key] is stack
+
+class RewriteLoop(Exception):
+    '''
+    Raised when rules bring back a stack they had before without reading
+    input in between, rules holds the rules applied in the cycle
+    '''
+    def __init__(self, report, rules = (), stack = None):
+        super().__init__(report)
+        self.rules = rules
+        self.stack = stack
+
+    def __reduce__(self):
+        # rules may be compiled, so workers only send the report back
+        return (RewriteLoop, (str(self),))
+
+class LoopDetector():
+    '''
+    Remembers the stacks a run had since it last read input, identified by
+    hash-consed cell. With pure rules the stack alone decides what happens
+    next, so seeing one again means the run will never read input again.
+    Cycles longer than window applications may take a few windows to find.
+    Cells are only hash-consed within a window, so memory stays bounded.
+    '''
+    def __init__(self, window):
+        self.window = window
+        self.seen = {}
+        self.rules = deque(maxlen = window)
+        self.count = 0
+        self.conser = Conser()
+
+    def pushed(self, stack):
+        self.seen.clear()
+        self.rules.clear()
+        self.count = 0
+        self.conser.reset(stack)
+        self.seen[id(stack)] = 0
+
+    def applied(self, rule, stack, rest):
+        '''
+        Returns the hash-consed copy of stack, which rule made on top of
+        rest, raises RewriteLoop if it was seen before
+        '''
+        stack = self.conser.intern(stack, rest)
+        self.count += 1
+        self.rules.append(rule)
+        start = self.seen.get(id(stack))
+        if start is not None:
+            from rule import location
+            rules = list(self.rules)[start - self.count:]
+            lines = [f'{location(rule)}: {rule}' for rule in rules]
+            raise RewriteLoop(f'rules loop without reading input after ' +
+                              f'{len(rules)} applications:\n' +
+                              '\n'.join(lines), rules, stack)
+        if len(self.seen) > self.window:
+            self.pushed(stack)
+        else:
+            self.seen[id(stack)] = self.count
+        return stack
+
+class FrozenWriter():
+    '''
+    Writes out the bottom of the stack once no rule can reach it anymore,
+    see analysis.stream_window
+    '''
+    def __init__(self, outfile, seperator, window, every = 4096,
+                 chunk = 1 << 16):
+        self.writer = StackWriter(outfile, seperator, chunk)
+        self.window = window
+        self.every = every
+
+    def flush(self, stack):
+        try:
+            live, frozen = take(self.window, stack)
+        except Exception:
+            return stack
+        if not frozen:
+            return stack
+        self.writer.write(frozen)
+        stack = empty_like(stack)
+        for token in live:
+            stack = cons(token, stack)
+        return stack
+
+    def finish(self, stack):
+        self.writer.write(stack)
+
+class StackWriter():
+    '''
+    Writes stacks bottom first to outfile, joining up to chunk tokens into
+    every write. Consecutive stacks continue the same output.
+    '''
+    def __init__(self, outfile, seperator, chunk = 1 << 16):
+        self.outfile = outfile
+        self.seperator = seperator
+        self.chunk = chunk
+        self.started = False
+
+    def write(self, stack):
+        for tokens in segments(stack, self.chunk):
+            if self.started:
+                self.outfile.write(self.seperator)
+            self.outfile.write(self.seperator.join(tokens))
+            self.started = True
+
+class PrependableGenerator():
+    def __init__(self, base_gen):
+        self.base_gen = base_gen
+        self.but_first = []
+        self.halted = False
+        self.paused = False
+        self.read = 0
+        self.steps = 0
+
+    def prepend(self, seq):
+        self.but_first += reversed(seq)
+
+    def __next__(self):
+        if self.but_first:
+            return self.but_first.pop()
+        else:
+            self.read += 1
+            return next(self.base_gen)
+
+    def __iter__(self):
+        return self
+
+def input_generator(seperator):
+    while True:
+        line = input()
+        for token in line.split(seperator):
+            yield intern(token)
+        
+def token_generator(file, sep, prefetched = False, counter = None):
+    from streams import read_tokens
+    return read_tokens(file, sep, prefetched, counter = counter)
+
+def write_stack(stack, outfile, seperator, chunk = 1 << 16):
+    StackWriter(outfile, seperator, chunk).write(stack)
@@ -0,0 +1,145 @@
+from rule import Rule, LiteralString, CapturingChoice, car, cdr
+from analysis import is_pure, extent
+
+def top_literals(pattern, seen = None):
+    '''
+    Returns the set of tokens that can be on top of the stack when pattern
+    matches, or None if pattern can match any top token
+    '''
+    seen = set() if seen is None else seen
+    if pattern in seen:
+        return None
+    seen.add(pattern)
+    literals = set()
+    for choice in pattern.choices:
+        if isinstance(choice, LiteralString):
+            literals.add(choice.text)
+        elif isinstance(choice, CapturingChoice):
+            literals.update(choice.terminals)
+        elif type(choice) is Rule and choice.lhs:
+            inner = top_literals(choice.lhs[-1][0], seen)
+            if inner is None:
+                return None
+            literals |= inner
+        else:
+            return None
+    return literals
+
+def top_tests(pattern, seen = None):
+    '''
+    Returns the tokens and the token predicates of builtins that can
+    accept the top of the stack when pattern matches, or None if pattern
+    can match any top token
+    '''
+    seen = set() if seen is None else seen
+    if pattern in seen:
+        return None
+    seen.add(pattern)
+    literals, tests = set(), []
+    for choice in pattern.choices:
+        if isinstance(choice, LiteralString):
+            literals.add(choice.text)
+        elif isinstance(choice, CapturingChoice):
+            literals.update(choice.terminals)
+        elif type(choice) is Rule and choice.lhs:
+            inner = top_tests(choice.lhs[-1][0], seen)
+            if inner is None:
+                return None
+            literals |= inner[0]
+            tests += inner[1]
+        elif getattr(choice, 'accepts', None):
+            tests.append(choice.accepts)
+        else:
+            return None
+    return literals, tests
+
+def inert_test(keys, fallback):
+    literals, tests = set(keys), []
+    for rule in fallback:
+        top = top_tests(rule.lhs[-1][0]) if rule.lhs else None
+        if top is None:
+            return None
+        literals |= top[0]
+        tests += top[1]
+    literals = frozenset(literals)
+    if not tests:
+        return lambda token: token not in literals
+    return lambda token: (token not in literals and
+                          not any(test(token) for test in tests))
+
+def cell_keys(rule):
+    '''
+    Returns the top_literals of the cells rule reads from the top down, as
+    far as every term before them covers exactly one cell
+    '''
+    keys = []
+    for pattern, *_ in reversed(rule.lhs):
+        keys.append(top_literals(pattern))
+        if extent(pattern) != (1, 1, 1):
+            break
+    return keys
+
+class _Node(object):
+    '''
+    Tests the stack cell at depth, leading to a _Node or list of candidate
+    rules for every token, and to fallback for any other token
+    '''
+    def __init__(self, depth, buckets, fallback):
+        self.depth = depth
+        self.buckets = buckets
+        self.fallback = fallback
+
+def _build(rules, keys, depth, max_depth, leaf):
+    while depth < max_depth and len(rules) > leaf:
+        at = [keys[id(rule)][depth] if depth < len(keys[id(rule)]) else None
+              for rule in rules]
+        if any(key is not None for key in at):
+            break
+        depth += 1
+    else:
+        return rules
+    fallback = [rule for rule, key in zip(rules, at) if key is None]
+    by_token = {}
+    for position, key in enumerate(at):
+        for token in key or ():
+            by_token.setdefault(token, []).append(position)
+    open_positions = [position for position, key in enumerate(at)
+                      if key is None]
+    buckets = {}
+    for token, positions in by_token.items():
+        merged = sorted(positions + open_positions)
+        buckets[token] = _build([rules[i] for i in merged], keys, depth + 1,
+                                max_depth, leaf)
+    return _Node(depth, buckets,
+                 _build(fallback, keys, depth + 1, max_depth, leaf))
+
+class RuleIndex(object):
+    '''
+    Discrimination tree over the cells near the top of the stack, leading
+    to the rules that can match it in the order they were introduced.
+    Every stack cell is looked up once, in a dict of the tokens rules
+    expect there. inert tells if no rule can match with a token on top, it
+    is None if some rule can match any token.
+    '''
+    def __init__(self, rules, max_depth = 4, leaf = 2):
+        self.rules = rules
+        self.pure = all(is_pure(rule) for rule in rules)
+        keys = dict((id(rule), cell_keys(rule) if rule.lhs else [])
+                    for rule in rules)
+        top = [keys[id(rule)][0] if keys[id(rule)] else None for rule in rules]
+        fallback = [rule for rule, key in zip(rules, top) if key is None]
+        literals = set().union(*(key for key in top if key is not None))
+        self.inert = inert_test(literals, fallback)
+        self.root = _build(list(rules), keys, 0, max_depth, leaf)
+
+    def candidates(self, stack):
+        node, depth = self.root, 0
+        while node.__class__ is _Node:
+            while depth < node.depth and stack:
+                stack = cdr(stack)
+                depth += 1
+            if stack:
+                node = node.buckets.get(car(stack), node.fallback)
+            else:
+                node = node.fallback
+        return node
@@ -1,7 +1,67 @@
+class ArrayStack(object):
+    '''
+    Persistent stack kept in shared python lists, as an alternative to
+    cons cells. A node sees the first size items of its list on top of
+    tail. Pushing onto the newest node of a list appends in place, pushing
+    anywhere else starts a new list, so a node never sees a later change.
+    That makes tokens that are only pushed far cheaper than cons cells,
+    but a push after a rewrite costs a node and a list, more than a cell.
+    Nodes unpack like a (head, tail) pair.
+    '''
+    __slots__ = ('items', 'size', 'tail')
+
+    def __init__(self, items = None, size = 0, tail = None):
+        self.items = [] if items is None else items
+        self.size = size
+        self.tail = tail
+
+    def push(self, item):
+        if len(self.items) == self.size:
+            self.items.append(item)
+            return ArrayStack(self.items, self.size + 1, self.tail)
+        return ArrayStack([item], 1, self)
+
+    def pop(self, n = 1):
+        if n < self.size:
+            return ArrayStack(self.items, self.size - n, self.tail)
+        elif n == self.size:
+            if self.tail is None:
+                return ArrayStack(self.items, 0, None)
+            return self.tail
+        raise Exception('List too short')
+
+    def head(self):
+        if not self.size:
+            raise Exception('Null list')
+        return self.items[self.size - 1]
+
+    def same(self, other):
+        return (other.__class__ is ArrayStack and self.items is other.items
+                and self.size == other.size)
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __iter__(self):
+        return iter((self.head(), self.pop()))
+
+    def __getitem__(self, i):
+        return (self.head(), self.pop())[i]
+
+def empty_like(list):
+    '''
+    Returns an empty stack of the same representation as list
+    '''
+    return ArrayStack() if list.__class__ is ArrayStack else None
+
 def cons(item, tail):
+    if tail.__class__ is ArrayStack:
+        return tail.push(item)
     return (item, tail)
 
 def car(list):
+    if list.__class__ is ArrayStack:
+        return list.head()
     try:
         head, _ = list
         return head
@@ -9,6 +69,8 @@ def car(list):
         raise Exception('Null list')
 
 def cdr(list):
+    if list.__class__ is ArrayStack and list:
+        return list.pop()
     try:
         _, tail = list
         return tail
@@ -16,11 +78,38 @@ def cdr(list):
         raise Exception('Null list')
 
 def flatten(list):
-    def linked_generator(list):
-        while list:
+    items = []
+    while list:
+        if list.__class__ is ArrayStack:
+            items += list.items[list.size - 1::-1]
+            list = list.tail
+        else:
+            head, list = list
+            items.append(head)
+    return tuple(items)
+def segments(list, size = 1 << 16):
+    '''
+    Yields the items of list bottom first, in lists of at most size items
+    '''
+    parts = []
+    while list:
+        if list.__class__ is ArrayStack:
+            parts.append((list.items, list.size))
+            list = list.tail
+            continue
+        run = []
+        append = run.append
+        while list.__class__ is tuple:
             head, list = list
-            yield head
-    return tuple(linked_generator(list))
+            append(head)
+        run.reverse()
+        parts.append((run, len(run)))
+    for items, end in reversed(parts):
+        if end == len(items) <= size:
+            yield items
+            continue
+        for start in range(0, end, size):
+            yield items[start:min(start + size, end)]
 
 def unflatten(flat_list):
     def inner_unflatten(gen):
@@ -32,6 +121,9 @@ def unflatten(flat_list):
     return inner_unflatten(elem for elem in flat_list)
 
 def take(n, list):
+    if list.__class__ is ArrayStack and n <= list.size:
+        return (tuple(list.items[list.size - n:list.size]),
+                list.pop(n) if n else list)
     try:
         head = []
         for _ in range(n, 0, -1):
@@ -40,3 +132,99 @@ def take(n, list):
         return (tuple(reversed(head)), list)
     except:
         raise Exception('List too short')
+
+def distance(list, base):
+    '''
+    Number of cells on top of base, None if base isn't a tail of list
+    '''
+    count = 0
+    while list is not base:
+        if list.__class__ is ArrayStack and list.same(base):
+            break
+        if not list:
+            return None
+        _, list = list
+        count += 1
+    return count
+
+class Height(object):
+    '''
+    Follows the height of a stack and its peak from the cells pushed and
+    the cells rules replace, without walking the whole stack
+    '''
+    def __init__(self):
+        self.height = 0
+        self.peak = 0
+
+    def pushed(self):
+        self.height += 1
+        if self.height > self.peak:
+            self.peak = self.height
+
+    def applied(self, stack, rest, new_stack):
+        consumed, produced = distance(stack, rest), distance(new_stack, rest)
+        if consumed is None or produced is None:
+            self.height = len(flatten(new_stack))
+        else:
+            self.height += produced - consumed
+        if self.height > self.peak:
+            self.peak = self.height
+
+class Conser(object):
+    '''
+    Hash-conses the cells built on top of a base stack, so that two stacks
+    made of them are equal exactly when they are the same object. The base
+    is a single chain, so its own cells are told apart by identity already,
+    and a cell equal to one of them is the base cell itself. Only cells made
+    since the last reset are kept, which bounds the table.
+    '''
+    def __init__(self, base = None):
+        self.reset(base)
+
+    def reset(self, base):
+        self.table = {}
+        self.made = set()
+        self.base = base
+        self.parents = {}
+        self.walked = base
+
+    def _parent(self, tail):
+        # the base cell right above tail, found by walking the base down
+        # from its top once
+        parents = self.parents
+        parent = parents.get(id(tail))
+        while parent is None and self.walked is not None:
+            cell = self.walked
+            self.walked = cell[1]
+            parents[id(cell[1])] = cell
+            if cell[1] is tail:
+                return cell
+        return parent
+
+    def cons(self, item, tail):
+        key = (item, id(tail))
+        cell = self.table.get(key)
+        if cell is None:
+            if id(tail) not in self.made:
+                cell = self._parent(tail)
+            if cell is None or cell[0] != item:
+                cell = (item, tail)
+                self.made.add(id(cell))
+            self.table[key] = cell
+        return cell
+
+    def intern(self, list, rest):
+        '''
+        Returns the canonical copy of list, which is made of new cells on
+        top of rest, a canonical stack
+        '''
+        items = []
+        while list is not rest:
+            head, list = list
+            items.append(head)
+        for item in reversed(items):
+            list = self.cons(item, list)
+        return list
+
+    def __len__(self):
+        return len(self.table)
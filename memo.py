@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from rule import Rule
+from analysis import is_pure
+
+class MatchMemo(object):
+    '''
+    Bounded cache of labelled matcher results, keyed on the matcher and the
+    identity of the stack node it was tried on. Entries keep their node
+    alive, so an id is never reused while it is cached.
+    '''
+    def __init__(self, size = 4096):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def wrap(self, rule, match):
+        entries = self.entries
+        rule_id = id(rule)
+        def memo_match(stack):
+            key = (rule_id, id(stack))
+            entry = entries.get(key)
+            if entry is not None and entry[0] is stack:
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            result = match(stack)
+            entries[key] = (stack, result)
+            if len(entries) > self.size:
+                entries.popitem(last = False)
+            return result
+        return memo_match
+
+    def install(self, named_rules):
+        '''
+        Memoizes every pure labelled rule in named_rules
+        '''
+        for rules in named_rules.values():
+            for rule in rules:
+                if type(rule) is Rule and is_pure(rule):
+                    rule.match = self.wrap(rule, rule.match)
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return (f'memo: {self.hits} hits, {self.misses} misses ' +
+                f'({rate:.1%}), {len(self.entries)}/{self.size} entries')
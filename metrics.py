@@ -0,0 +1,178 @@
+'''
+Live counters for long running jobs.
+Metrics follows the engine as its observer, counting tokens, rule
+applications and the stack height, and is told the bytes read from every
+infile by the tokenizer. Snapshots can be dumped on a signal or written to a
+JSON or Prometheus text file every few seconds, from a background thread.
+'''
+from time import monotonic
+from linked_list import Height
+import json, os, signal, sys, tempfile, threading
+
+class Metrics(object):
+    def __init__(self, inner = None):
+        '''
+        inner is another observer, told everything Metrics is
+        '''
+        self.inner = inner
+        self.input = None
+        self.infile = None
+        self.bytes_read = {}
+        self.tokens = 0
+        self.applications = 0
+        self.height = Height()
+        self.started = monotonic()
+        self.ended = None
+        self.windows = {}
+        self.writer = None
+
+    def reading(self, infile):
+        '''
+        Starts counting bytes for infile
+        '''
+        self.infile = infile
+        self.bytes_read.setdefault(infile, 0)
+
+    def read(self, count):
+        self.bytes_read[self.infile] = self.bytes_read.get(self.infile, 0) + count
+
+    def pushed(self, stack):
+        self.tokens += 1
+        self.height.pushed()
+        if self.inner is not None:
+            self.inner.pushed(stack)
+
+    def applied(self, rule, stack, rest, new_stack):
+        self.applications += 1
+        self.height.applied(stack, rest, new_stack)
+        if self.inner is not None:
+            self.inner.applied(rule, stack, rest, new_stack)
+
+    def finish(self):
+        '''
+        Marks the end of the run, later snapshots measure time up to here
+        '''
+        if self.ended is None:
+            self.ended = monotonic()
+
+    def snapshot(self, window = None):
+        '''
+        Current counters as a dict. steps_per_sec is measured since the
+        previous snapshot of the same window, so every consumer keeps its
+        own rate.
+        '''
+        now = self.ended or monotonic()
+        steps = self.tokens + self.applications
+        since, before, rate = self.windows.get(window, (self.started, 0, 0.0))
+        if now > since:
+            rate = (steps - before) / (now - since)
+        self.windows[window] = (now, steps, rate)
+        elapsed = now - self.started
+        prepends = self.input.but_first if self.input is not None else ()
+        return {'elapsed': elapsed, 'infile': self.infile,
+                'bytes_read': dict(self.bytes_read), 'tokens': self.tokens,
+                'applications': self.applications,
+                'stack_depth': self.height.height,
+                'peak_stack_depth': self.height.peak,
+                'prepend_queue': len(prepends), 'steps_per_sec': rate,
+                'mean_steps_per_sec': steps / elapsed if elapsed else 0.0}
+
+    def dump(self, outfile, window = None):
+        json.dump(self.snapshot(window), outfile)
+        outfile.write('\n')
+        outfile.flush()
+
+    def on_signal(self, signum = None, outfile = None):
+        '''
+        Dumps a snapshot to outfile, stderr by default, whenever signum
+        arrives, SIGUSR1 by default. Returns False where there is no such
+        signal.
+        '''
+        if signum is None:
+            signum = getattr(signal, 'SIGUSR1', None)
+            if signum is None:
+                return False
+        signal.signal(signum,
+                      lambda *_: self.dump(outfile or sys.stderr, 'signal'))
+        return True
+
+    def write_every(self, path, interval = 10.0):
+        '''
+        Replaces path with a snapshot every interval seconds until stop,
+        in Prometheus text format if path ends in .prom, as JSON if not
+        '''
+        self._stop_writer()
+        done = threading.Event()
+        def write():
+            while not done.wait(interval):
+                write_snapshot(self.snapshot('file'), path)
+            write_snapshot(self.snapshot('file'), path)
+        thread = threading.Thread(target = write, daemon = True)
+        self.writer = (done, thread)
+        thread.start()
+
+    def stop(self):
+        '''
+        Ends the run and stops periodic writing, after writing a last
+        snapshot
+        '''
+        self.finish()
+        self._stop_writer()
+
+    def _stop_writer(self):
+        if self.writer:
+            done, thread = self.writer
+            done.set()
+            thread.join()
+            self.writer = None
+
+def prometheus(snapshot, prefix = 'sessile'):
+    '''
+    snapshot in the Prometheus text exposition format
+    '''
+    def escape(label):
+        return (str(label).replace('\\', '\\\\').replace('"', '\\"')
+                .replace('\n', '\\n'))
+    lines = []
+    def metric(name, kind, value, help):
+        lines.append(f'# HELP {prefix}_{name} {help}')
+        lines.append(f'# TYPE {prefix}_{name} {kind}')
+        if isinstance(value, dict):
+            for label, count in value.items():
+                lines.append(f'{prefix}_{name}{{infile="{escape(label)}"}} {count}')
+        else:
+            lines.append(f'{prefix}_{name} {value}')
+    metric('tokens_total', 'counter', snapshot['tokens'], 'Tokens read.')
+    metric('bytes_read_total', 'counter', snapshot['bytes_read'],
+           'Bytes read per infile.')
+    metric('rule_applications_total', 'counter', snapshot['applications'],
+           'Rules applied.')
+    metric('stack_depth', 'gauge', snapshot['stack_depth'],
+           'Cells on the stack.')
+    metric('stack_depth_peak', 'gauge', snapshot['peak_stack_depth'],
+           'Most cells on the stack so far.')
+    metric('prepend_queue', 'gauge', snapshot['prepend_queue'],
+           'Tokens prepended to the input and not yet read.')
+    metric('steps_per_second', 'gauge', snapshot['steps_per_sec'],
+           'Tokens read and rules applied per second.')
+    metric('elapsed_seconds', 'gauge', snapshot['elapsed'],
+           'Seconds since metrics started.')
+    return '\n'.join(lines) + '\n'
+
+def write_snapshot(snapshot, path):
+    '''
+    Atomically replaces path with snapshot
+    '''
+    if path.endswith('.prom'):
+        text = prometheus(snapshot)
+    else:
+        text = json.dumps(snapshot, indent = 2) + '\n'
+    directory = os.path.dirname(path) or '.'
+    tmp = tempfile.NamedTemporaryFile('w', dir = directory, delete = False)
+    try:
+        with tmp:
+            tmp.write(text)
+        os.replace(tmp.name, path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
@@ -0,0 +1,202 @@
+'''
+Runs inputs on a pool of worker processes.
+Every worker holds a copy of the engine with its rules already compiled,
+and each job gets its own stack and builtin state.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from engine import token_generator, write_stack
+from linked_list import cons, cdr, flatten
+from streams import open_input, open_output
+import io, os
+
+_engine = None
+
+def _init_worker(engine):
+    global _engine
+    _engine = engine
+    _engine.prepare()
+
+def _run_file(path, seperator, outpath):
+    with open_input(path) as infile:
+        stack = _engine.process(token_generator(infile, seperator))
+    if outpath:
+        with open_output(outpath) as outfile:
+            write_stack(stack, outfile, seperator)
+        return None
+    output = io.StringIO()
+    write_stack(stack, output, seperator)
+    return output.getvalue()
+
+class Collision(Exception):
+    pass
+
+def output_paths(paths, outdir):
+    '''
+    Where each of paths is written in outdir, refusing inputs that would
+    overwrite each other's output
+    '''
+    written = {}
+    for path in paths:
+        outpath = os.path.join(outdir, os.path.basename(path))
+        if outpath in written:
+            raise(Collision(f'{written[outpath]} and {path} would both be ' +
+                            f'written to {outpath}'))
+        written[outpath] = path
+    return list(written)
+
+def run_isolated(engine, paths, seperator, jobs = None, outfile = None,
+                 outdir = None):
+    '''
+    Runs every file in paths on its own, either writing one file per input
+    into outdir, which is created if needed, or all results in input order
+    to outfile
+    '''
+    outpaths = (output_paths(paths, outdir) if outdir else
+                [None] * len(paths))
+    if outdir:
+        os.makedirs(outdir, exist_ok = True)
+    engine.prepare()
+    with ProcessPoolExecutor(jobs, initializer = _init_worker,
+                             initargs = (engine,)) as pool:
+        started = False
+        for result in pool.map(_run_file, paths, [seperator] * len(paths),
+                               outpaths):
+            if outfile is None or not result:
+                continue
+            if started:
+                outfile.write(seperator)
+            outfile.write(result)
+            started = True
+
+def _cut(data, seperator):
+    '''
+    Returns (end, start of next chunk) of the first token boundary in data
+    after its first byte, or None. The first byte is only looked at, so a
+    seperator at the start of a line isn't mistaken for one ending a token.
+    Cutting just after a newline is always safe, single character
+    separators are safe to cut at as well.
+    '''
+    if not seperator:
+        for i in range(1, len(data)):
+            if data[i] & 0xc0 != 0x80 and data[i - 1] != ord('\r'):
+                return (i, i)
+        return None
+    cuts = []
+    newline = data.find(b'\n')
+    if newline >= 0:
+        cuts.append((newline + 1, newline + 1))
+    if len(seperator) == 1 and seperator not in '\r\n':
+        sep = seperator.encode(_encoding())
+        found = data.find(sep, 1)
+        if found >= 0:
+            cuts.append((found, found + len(sep)))
+    return min(cuts) if cuts else None
+
+def _encoding():
+    import locale
+    return locale.getpreferredencoding(False)
+
+def split_file(path, seperator, chunks, scan = 1 << 16):
+    '''
+    Returns byte ranges (start, end) of up to chunks pieces of path, which
+    tokenize the same way as the whole file does
+    '''
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as infile:
+        for k in range(1, chunks):
+            offset = max(size * k // chunks, start, 1)
+            while offset < size:
+                infile.seek(offset - 1)
+                data = infile.read(scan + 2)
+                cut = _cut(data, seperator)
+                if cut:
+                    end, next_start = offset - 1 + cut[0], offset - 1 + cut[1]
+                    break
+                offset += scan
+            else:
+                break
+            # an empty last chunk would lose the empty token after a
+            # trailing seperator
+            if start < end and next_start < size:
+                ranges.append((start, end))
+                start = next_start
+    ranges.append((start, size))
+    return ranges
+
+def _chunk_tokens(path, start, end, seperator):
+    with open(path, 'rb') as infile:
+        infile.seek(start)
+        data = infile.read(end - start)
+    text = io.TextIOWrapper(io.BytesIO(data), encoding = _encoding())
+    return token_generator(text, seperator)
+
+def top_cells(stack, n):
+    cells = []
+    while stack and len(cells) < n:
+        head, stack = stack
+        cells.append(head)
+    return tuple(cells) if len(cells) == n else None
+
+def height(stack):
+    count = 0
+    while stack:
+        _, stack = stack
+        count += 1
+    return count
+
+def _run_chunk(path, start, end, seperator, window, probes):
+    '''
+    Runs one chunk from an empty stack. Returns the resulting stack top
+    first, and the height and top window of the stack after each of the
+    first probes tokens.
+    '''
+    _engine.reset()
+    tokens = _chunk_tokens(path, start, end, seperator)
+    stack = None
+    seen = []
+    for token in tokens:
+        stack = _engine.run((token,), stack)
+        seen.append((height(stack), top_cells(stack, window)))
+        if len(seen) == probes:
+            break
+    stack = _engine.run(tokens, stack)
+    return flatten(stack), seen
+
+def run_chunked(engine, paths, seperator, window, chunks, jobs = None,
+                probes = 256):
+    '''
+    Splits every file into chunks that are run in parallel, then joins them
+    in order. Rules for which analysis.chunk_window holds only ever look at
+    the top window cells and never shrink the stack, so once the stack of
+    the previous chunks, continued with the first tokens of a chunk, has
+    the same top window as the chunk run on its own had at that point,
+    everything the chunk did from there on carries over unchanged.
+    '''
+    engine.prepare()
+    pieces = [(path, start, end) for path in paths
+              for start, end in split_file(path, seperator, chunks)]
+    with ProcessPoolExecutor(jobs, initializer = _init_worker,
+                             initargs = (engine,)) as pool:
+        results = pool.map(_run_chunk, *zip(*pieces),
+                           *([arg] * len(pieces)
+                             for arg in (seperator, window, probes)))
+        engine.reset()
+        stack = None
+        for (path, start, end), (cells, seen) in zip(pieces, results):
+            tokens = _chunk_tokens(path, start, end, seperator)
+            # seen first, so running out of it doesn't use up a token
+            for (chunk_height, chunk_top), token in zip(seen, tokens):
+                stack = engine.run((token,), stack)
+                if chunk_top is not None and \
+                   top_cells(stack, window) == chunk_top:
+                    for _ in range(window):
+                        stack = cdr(stack)
+                    frozen = chunk_height - window
+                    for cell in reversed(cells[:len(cells) - frozen]):
+                        stack = cons(cell, stack)
+                    break
+            else:
+                stack = engine.run(tokens, stack)
+    return stack
@@ -1,33 +1,33 @@
-from rule import Bound, Unbound, Rule, PlaceHolderRule, LiteralString, FreeVar, CapturingChoice
+from rule import (Bound, Unbound, Blank, Rule, PlaceHolderRule, LiteralString,
+                  FreeVar, Anything, CapturingChoice)
 
 import re
 
+_arg = r'(?:[A-Z]+|\".*\"|_)'
+_term = re.compile(r'"(?P<string>.*)"|(?P<freevar>[A-Z]+)|(?P<nullvar>_)|' +
+                   r'(?P<pattern>[a-z][a-z0-9]*)|' +
+                   r'(?P<fun>[a-z][a-z0-9]*)\(' +
+                   rf'(?P<args>{_arg}(?:\,\s*{_arg})*)\)')
+
 def parse_term(text, fun_ref):
-    [string, pattern, fun, freevar, nullvar] = \
-            [re.fullmatch(ex, text) for ex in
-            [r'"(.*)"',
-             r'([a-z][a-z0-9]*)',
-             r'([a-z][a-z0-9]*)\(((?:(?:[A-Z]+)|(?:\".*\")|_)' +
-             r'(?:\,\s*(?:(?:[A-Z]+)|(?:\".*\")|_))*)\)',
-             # Terribly sorry about the mess
-             r'([A-Z]+)',
-             r'(_)'
-         ]]
-    if string:
-        return (LiteralString(string.group(1)),)
-    elif freevar:
-        return (FreeVar(), Unbound(freevar.group(1)[0]))
-    elif nullvar:
+    term = _term.fullmatch(text)
+    # a function's last group is its arguments
+    kind = term.lastgroup if term else None
+    if kind == 'string':
+        return (LiteralString(term.group('string')),)
+    elif kind == 'freevar':
+        return (FreeVar(), Unbound(term.group('freevar')[0]))
+    elif kind == 'nullvar':
         return (Anything(),)
-    elif pattern:
-        name = pattern.group(1)
+    elif kind == 'pattern':
+        name = term.group('pattern')
         correct_pattern = next(fun for fun in fun_ref[name]
                                if fun.right_arity(0))
         return (correct_pattern,)
-    elif fun:
-        name = fun.group(1)
+    elif kind == 'args':
+        name = term.group('fun')
         vars = []
-        for raw_var in re.split(r'\,\s', fun.group(2)):
+        for raw_var in re.split(r'\,\s', term.group('args')):
             [bound, unbound, blank] = \
                     [re.fullmatch(ex, raw_var) for ex in
                     [r'"(.*)"',
@@ -89,7 +89,9 @@ def parse_rule(line, rules, named_rules):
         named_rules[label] = [rule for rule in named_rules[label]
                               if not isinstance(rule, PlaceHolderRule)]
     else:
-        rules.append(Rule(lhs, rhs))
+        new_rule = Rule(lhs, rhs)
+        rules.append(new_rule)
+    return new_rule
 
 def parse_capture(line, named_rules):
     label = re.sub(r'(.*):', r'\1', line[0])
@@ -101,70 +103,36 @@ def parse_capture(line, named_rules):
         named_rules[label].append(new_rule)
     else:
         named_rules[label] = [new_rule]
+    return new_rule
+
+_token = re.compile(r'[ \t]*(?:(-.|[|_])|("[^"]*")|(?![-|_"])' +
+                    r'([^ \t(]*\([^)]*\)|[^ \t(]+(?=[ \t]|\Z)))', re.S)
 
 def split_rule(l):
-    # Ok, so this is basically a miniature RDP, derp.
-    ln = (c for c in l)
-    ch = next(ln)
-    def adv():
-        nonlocal ch
-        old_ch = ch
-        ch = next(ln)
-        return old_ch
-    def eat_space():
-        while ch in ' \t':
-            adv()
-    def parse_string():
-        adv()
-        def parse_escape():
-            return {'\\': '\\', '"': '"', 'a': '\a', 'b': '\b', 'f': '\f',
-                    'n': '\n', 'r': '\r', 't': '\t', 'v' : '\v'}[adv()]
-        res = ''
-        while not ch == '"':
-            if ch == '\\':
-                res += parse_escape()
-            else:
-                res += adv()
-        return f'"{res}"'
-    def parse_term():
-        res = ''
-        while ch not in ' \t(':
-            res += adv()
-        if ch == '(':
-            res += adv()
-            while not ch == ')':
-                res += adv()
-            res += ch
-        return res
-    def parse_op():
-        res = ch
-        if ch == '-':
-            adv()
-            res += ch
-        return res
-    rules = []
-    while True:
-        try:
-            eat_space()
-            if ch in '-|_':
-                rules.append(parse_op())
-            elif ch == '"':
-                rules.append(parse_string())
-            else:
-                rules.append(parse_term())
-            adv()
-        except:
+    '''
+    Splits a line into terms in one pass. Strings run up to the next quote,
+    other terms up to whitespace or through a closing paren. Anything that
+    can't be read ends the line.
+    '''
+    terms = []
+    pos, end = 0, len(l.rstrip(' \t'))
+    while pos < end:
+        token = _token.match(l, pos)
+        if not token:
             break
-    return rules
+        terms.append(token.group(token.lastindex))
+        pos = token.end()
+    return terms
 
-def parse_rules(input, named_rules = {}):
+def parse_rules(input, named_rules = None, source = None):
+    named_rules = {} if named_rules is None else named_rules
     lines = [[*split_rule(l)] for l in input.split('\n')]
     rules = []
-    for line in lines:
+    for number, line in enumerate(lines, 1):
         if '->' in line:
-            parse_rule(line, rules, named_rules)
+            parse_rule(line, rules, named_rules).origin = (source, number)
         elif '|' in line:
-            parse_capture(line, named_rules)
+            parse_capture(line, named_rules).origin = (source, number)
         elif not line or re.fullmatch('#.*', line[0]):
             continue
         else:
@@ -0,0 +1,130 @@
+'''
+Per rule counters and timers.
+A Profiler wraps match and apply of every rule it is installed on, and
+follows the stack height as the engine's observer. Nothing is wrapped
+unless a profiler is installed.
+'''
+from time import perf_counter
+from linked_list import Height
+from rule import location
+import json
+
+class RuleStats(object):
+    def __init__(self, rule):
+        self.rule = rule
+        self.attempts = 0
+        self.nested = 0
+        self.matches = 0
+        self.match_time = 0.0
+        self.sub_time = 0.0
+        self.applies = 0
+        self.apply_time = 0.0
+
+    def self_time(self):
+        return self.match_time - self.sub_time + self.apply_time
+
+    def describe(self):
+        if hasattr(self.rule, 'name'):
+            return self.rule.name
+        try:
+            return str(self.rule)
+        except Exception:
+            return repr(self.rule)
+
+    def where(self):
+        return location(self.rule)
+
+    def as_dict(self):
+        return {'rule': self.describe(), 'where': self.where(),
+                'attempts': self.attempts, 'nested': self.nested,
+                'matches': self.matches, 'match_time': self.match_time,
+                'sub_time': self.sub_time, 'applies': self.applies,
+                'apply_time': self.apply_time}
+
+class Profiler(object):
+    def __init__(self):
+        self.stats = {}
+        self.saved = []
+        self.timers = []
+        self.height = Height()
+
+    def wrap_match(self, stats, match):
+        timers = self.timers
+        def profiled_match(stack):
+            if timers:
+                stats.nested += 1
+            else:
+                stats.attempts += 1
+            timers.append(0.0)
+            start = perf_counter()
+            try:
+                result = match(stack)
+            finally:
+                elapsed = perf_counter() - start
+                stats.sub_time += timers.pop()
+                stats.match_time += elapsed
+                if timers:
+                    timers[-1] += elapsed
+            if result:
+                stats.matches += 1
+            return result
+        return profiled_match
+
+    def wrap_apply(self, stats, apply):
+        def profiled_apply(values, stack):
+            stats.applies += 1
+            start = perf_counter()
+            try:
+                return apply(values, stack)
+            finally:
+                stats.apply_time += perf_counter() - start
+        return profiled_apply
+
+    def install(self, rules, named_rules):
+        for rule in [*rules, *(r for ls in named_rules.values() for r in ls)]:
+            if id(rule) in self.stats:
+                continue
+            stats = self.stats[id(rule)] = RuleStats(rule)
+            for name in ('match', 'apply'):
+                self.saved.append((rule, name, rule.__dict__.get(name)))
+            rule.match = self.wrap_match(stats, rule.match)
+            rule.apply = self.wrap_apply(stats, rule.apply)
+
+    def uninstall(self):
+        for rule, name, method in reversed(self.saved):
+            if method is None:
+                del rule.__dict__[name]
+            else:
+                rule.__dict__[name] = method
+        self.saved = []
+
+    def pushed(self, stack):
+        self.height.pushed()
+
+    def applied(self, rule, stack, rest, new_stack):
+        self.height.applied(stack, rest, new_stack)
+
+    def ranked(self):
+        return sorted((stats for stats in self.stats.values()
+                       if stats.attempts or stats.nested or stats.applies),
+                      key = lambda stats: stats.self_time(), reverse = True)
+
+    def report(self):
+        lines = [f'{"where":<24} {"tries":>9} {"nested":>9} {"hits":>8} ' +
+                 f'{"match ms":>9} {"self ms":>9} {"applied":>8} ' +
+                 f'{"apply ms":>9}  rule']
+        for stats in self.ranked():
+            lines.append(f'{stats.where():<24} {stats.attempts:>9} ' +
+                         f'{stats.nested:>9} {stats.matches:>8} ' +
+                         f'{stats.match_time * 1000:>9.1f} ' +
+                         f'{(stats.match_time - stats.sub_time) * 1000:>9.1f} ' +
+                         f'{stats.applies:>8} ' +
+                         f'{stats.apply_time * 1000:>9.1f}  ' +
+                         stats.describe())
+        lines.append(f'peak stack height: {self.height.peak}')
+        return '\n'.join(lines)
+
+    def dump(self, outfile):
+        json.dump({'peak_height': self.height.peak,
+                   'rules': [stats.as_dict() for stats in self.ranked()]},
+                  outfile, indent = 2)
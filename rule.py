@@ -50,16 +50,47 @@ def _unbound(ls):
 def _bound(ls):
     return [name for name in ls if isinstance(name, Bound)]
     
+class Effects(object):
+    '''
+    Returned by apply in place of a stack when applying also asks for
+    tokens to be prepended to the input, or for the run to halt
+    '''
+    __slots__ = ('stack', 'prepend', 'halt')
+
+    def __init__(self, stack, prepend = (), halt = False):
+        self.stack = stack
+        self.prepend = prepend
+        self.halt = halt
+
+    def after(self, earlier):
+        '''
+        Adds the effects of an earlier term of the same RHS, tokens
+        prepended later come first
+        '''
+        if earlier is not None:
+            self.prepend = [*self.prepend, *earlier.prepend]
+            self.halt = self.halt or earlier.halt
+        return self
+
+def location(rule):
+    '''
+    Where rule was defined as source:line, builtin for builtins, ? if unknown
+    '''
+    source, line = getattr(rule, 'origin', (None, None))
+    if line is None:
+        return 'builtin' if hasattr(rule, 'name') else '?'
+    return f'{source or "<rules>"}:{line}'
+
 class Rule(object):
-    
+    origin = (None, None)
+
     def __init__(self, lhs, rhs, label = None):
         self.label = label
         self.lhs = lhs
         self.rhs = rhs
         def var_names(ls):
-            from collections import OrderedDict
-            return OrderedDict.fromkeys([name for _, *names in ls
-                                         for name in names]).keys()
+            return tuple(dict.fromkeys([name for _, *names in ls
+                                        for name in names]))
         self.lhs_names = var_names(lhs)
         self.rhs_names = var_names(rhs)
         self.lhs_param = _unbound(self.lhs_names)
@@ -125,10 +156,12 @@ class Rule(object):
 
     def apply(self, values, stack):
         '''
-        Given variable bindings, returns stack after unpacking RHS
+        Given variable bindings, returns stack after unpacking RHS, or
+        Effects holding it if any term had effects
         '''
         binding = dict((*zip(self.rhs_param, values),
                         *((x, x.value) for x in _bound(self.rhs_names))))
+        effects = None
         for rule, *names in self.rhs:
             def arglist(item):
                 return isinstance(item, (tuple, list))
@@ -137,6 +170,12 @@ class Rule(object):
             else:
                 vars = [binding[name] for name in names]
                 stack = rule.apply(vars, stack)
+            if stack.__class__ is Effects:
+                effects = stack.after(effects)
+                stack = stack.stack
+        if effects is not None:
+            effects.stack = stack
+            return effects
         return stack
 
 class PlaceHolderRule(Rule):
@@ -225,15 +264,16 @@ class CapturingChoice(Rule):
         self.arity = 1
         self.choices = [self]
         self.terminals = terminals
+        self.terminal_set = frozenset(terminals)
 
     @overrides
     def match(self, stack):
-        try:
-            head, stack = stack
-            assert(head in self.terminals)
-            return ([head], stack)
-        except:
+        if not stack:
             return None
+        head, stack = stack
+        if head in self.terminal_set:
+            return ([head], stack)
+        return None
 
     @overrides
     def apply(self, values, stack):
@@ -246,5 +286,5 @@ class CapturingChoice(Rule):
 
     @overrides
     def __str__(self):
-        rule_body = ' | '.join(f'"{t}"' for t in terminals)
+        rule_body = ' | '.join(f'"{t}"' for t in self.terminals)
         return self.label + ': ' + rule_body
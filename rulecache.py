@@ -0,0 +1,93 @@
+'''
+Caches parsed and linked rules on disk, keyed by a hash of the rule sources
+and of the code that parses them. Builtins pickle as their name and the
+choices linked into them, everything else is pickled as is.
+'''
+from contextlib import contextmanager
+import gc, hashlib, os, pickle, sys, tempfile
+
+version = 2
+
+_modules = ['parser.py', 'rule.py', 'builtin.py']
+
+def cache_key(sources):
+    '''
+    Hex digest of sources, a list of (text, name), and the parser version
+    '''
+    digest = hashlib.sha256(f'{version} {sys.version_info[:2]}'.encode())
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in _modules:
+        with open(os.path.join(here, module), 'rb') as code:
+            digest.update(code.read())
+    for text, name in sources:
+        for part in (str(name), text):
+            data = part.encode('utf-8', 'surrogatepass')
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+    return digest.hexdigest()
+
+@contextmanager
+def _deep_graph():
+    # rule graphs nest deeply, and are all new objects, so collecting while
+    # walking them is wasted
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 100000))
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(limit)
+        if collecting:
+            gc.enable()
+
+def store(path, key, named_rules, rules):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok = True)
+    tmp = tempfile.NamedTemporaryFile('wb', dir = directory, delete = False)
+    try:
+        with tmp, _deep_graph():
+            pickle.dump((version, key, named_rules, rules), tmp,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp.name, path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+def fetch(path, key):
+    '''
+    Returns (named_rules, rules) cached at path for key, None if there is no
+    usable entry
+    '''
+    try:
+        with open(path, 'rb') as cached, _deep_graph():
+            stored_version, stored_key, named_rules, rules = \
+                    pickle.load(cached)
+    except Exception:
+        return None
+    if (stored_version, stored_key) != (version, key):
+        return None
+    return named_rules, rules
+
+def load_rules(sources, cache_dir):
+    '''
+    Returns (named_rules, rules) for sources, from cache_dir if they were
+    parsed before, parsing and storing them there if not
+    '''
+    from parser import parse_rules
+    from builtin import rule_table
+    key = cache_key(sources)
+    path = os.path.join(cache_dir, key + '.pickle')
+    cached = fetch(path, key)
+    if cached:
+        return cached
+    named_rules = rule_table()
+    rules = []
+    for text, name in sources:
+        named_rules, new_rules = parse_rules(text, named_rules, name)
+        rules += new_rules
+    try:
+        store(path, key, named_rules, rules)
+    except (OSError, pickle.PicklingError, RecursionError):
+        pass
+    return named_rules, rules
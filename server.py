@@ -0,0 +1,154 @@
+'''
+Serves one engine's rules to many clients at once over a TCP or Unix socket.
+Every connection is a session with its own stack, prepended tokens and get
+and set state, sharing the compiled rules. Clients send lines of tokens,
+split like in interactive mode, and get back what print writes as it
+happens, and the stack when they close their side or a rule stops the run.
+
+Sessions take turns of at most budget steps, so a busy session can't hold
+up the others, and are dropped once they used up max_steps. Lines are only
+read once the previous ones are processed, and output waits for the client
+to take it, so a client that sends or reads too slowly is slowed down
+rather than buffered for.
+'''
+from collections import deque
+from contextlib import redirect_stdout
+from engine import PrependableGenerator, run
+from linked_list import flatten
+from sys import intern
+import asyncio, io, os, stat
+
+class TokenQueue(object):
+    '''
+    Tokens received and not yet read. Running out only ends the current
+    turn, more tokens can be put in afterwards.
+    '''
+    def __init__(self):
+        self.tokens = deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.tokens.popleft()
+        except IndexError:
+            raise StopIteration
+
+class StepLimit(Exception):
+    pass
+
+class Session(object):
+    def __init__(self, engine, seperator = ' ', max_steps = None):
+        self.engine = engine
+        self.seperator = seperator
+        self.max_steps = max_steps
+        self.queue = TokenQueue()
+        self.input = PrependableGenerator(self.queue)
+        self.stack = engine.empty()
+        self.state = {}
+        self.steps = 0
+
+    def feed(self, line):
+        self.queue.tokens.extend(intern(token)
+                                 for token in line.split(self.seperator))
+
+    def busy(self):
+        return self.input.paused or bool(self.queue.tokens or
+                                         self.input.but_first)
+
+    @property
+    def halted(self):
+        return self.input.halted
+
+    def step(self, budget):
+        '''
+        Runs for at most budget steps, returns what rules printed meanwhile
+        '''
+        engine = self.engine
+        index = engine.prepare()
+        engine.use_state(self.state)
+        input = self.input
+        input.paused = False
+        input.steps = 0
+        printed = io.StringIO()
+        with redirect_stdout(printed):
+            self.stack = run(engine.named_rules, engine.rules, self.stack,
+                             input, index, None, None, engine.loop_window,
+                             None, budget)
+        self.steps += input.steps
+        if self.max_steps and self.steps >= self.max_steps:
+            raise StepLimit(f'session used up its {self.max_steps} steps')
+        return printed.getvalue()
+
+    def show(self):
+        return '[' + ', '.join(reversed(flatten(self.stack))) + ']\n'
+
+class Server(object):
+    def __init__(self, engine, seperator = ' ', budget = 1000,
+                 max_steps = None, show_stack = False):
+        '''
+        show_stack sends the stack after every line, not only at the end
+        '''
+        self.engine = engine
+        self.seperator = seperator
+        self.budget = budget
+        self.max_steps = max_steps
+        self.show_stack = show_stack
+        self.sessions = set()
+
+    async def handle(self, reader, writer):
+        session = Session(self.engine, self.seperator, self.max_steps)
+        self.sessions.add(session)
+        async def send(text):
+            if text:
+                writer.write(text.encode())
+                await writer.drain()
+        try:
+            while not session.halted:
+                line = await reader.readline()
+                if not line:
+                    break
+                session.feed(line.decode().rstrip('\r\n'))
+                while session.busy() and not session.halted:
+                    await send(session.step(self.budget))
+                    # let the other sessions have their turn
+                    await asyncio.sleep(0)
+                if self.show_stack and not session.halted:
+                    await send(session.show())
+            await send(session.show())
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as err:
+            try:
+                await send(f'error: {err}\n')
+            except ConnectionError:
+                pass
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, address, limit = 1 << 20):
+        '''
+        Serves on address, host:port for TCP or a path for a Unix socket,
+        until cancelled. limit is the longest line a client can send.
+        '''
+        self.engine.prepare()
+        host, _, port = address.rpartition(':')
+        if port.isdigit():
+            server = await asyncio.start_server(self.handle, host or None,
+                                                int(port), limit = limit)
+        else:
+            try:
+                if stat.S_ISSOCK(os.stat(address).st_mode):
+                    os.unlink(address)
+            except FileNotFoundError:
+                pass
+            server = await asyncio.start_unix_server(self.handle, address,
+                                                     limit = limit)
+        async with server:
+            await server.serve_forever()
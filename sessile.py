@@ -35,106 +35,245 @@ Rule files:
 Built-in functions:
 '''
 
-from parser import parse_term, parse_rules
-from rule import cons, flatten
-from builtin import default_named as start_table, UserInterrupt, PrependCondition
-import argparse
+from engine import Engine, RewriteLoop, token_generator, write_stack
+from streams import open_input, open_output, close_file, compression
+from itertools import islice
+import argparse, os, sys
 
-def run(named_rules, rules, stack, input):
+def input_path(path):
     try:
-        while True:
-            try:
-                rule, args, res_stack = next((rule, *match) for rule, match in
-                                             ((rule, rule.match(stack))
-                                              for rule in rules) if match)
-                try:
-                    stack = rule.apply(args, res_stack)
-                except PrependCondition as prep:
-                    stack = prep.stack
-                    input.prepend(prep.prepend)
-            except StopIteration:
-                try:
-                    stack = cons(next(input), stack)
-                except KeyboardInterrupt:
-                    raise UserInterrupt(*reversed(flatten(stack)))
-    except StopIteration:
-        return stack
-
-def run_batch(named_rules, rules, stack, input):
-    stack = run(named_rules, rules, stack, input)
-    return stack
+        if path != '-':
+            compression(path)
+        return path
+    except OSError as err:
+        raise argparse.ArgumentTypeError(f"can't open '{path}': {err}")
 
-def run_interactive(named_rules, rules, seperator):
-    stack = None
-    input = PrependableGenerator(input_generator(seperator))
+def output_file(path):
     try:
-        run(named_rules, rules, stack, input)
-    except UserInterrupt as err:
-        print('[' + ', '.join(err.args) + ']')
-
-class PrependableGenerator():
-    def __init__(self, base_gen):
-        self.base_gen = base_gen
-        self.but_first = []
+        return open_output(path)
+    except OSError as err:
+        raise argparse.ArgumentTypeError(f"can't open '{path}': {err}")
 
-    def prepend(self, seq):
-        self.but_first += reversed(seq)
-
-    def __next__(self):
-        if self.but_first:
-            return self.but_first.pop()
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Run the sessile stream processor')
+    parser.add_argument('-i', '--interactive', action = 'store_true')
+    parser.add_argument('source', type = argparse.FileType('r'), nargs = '*')
+    parser.add_argument('-c', '--seperator', type = str, default = '')
+    parser.add_argument('-f', '--infiles', type = input_path,
+                        nargs = '*', default = [],
+                        help = 'gzip, bzip2 and xz files are decompressed')
+    parser.add_argument('-o', '--outfile', type = output_file,
+                        nargs = 1,
+                        help = 'compressed if named .gz, .bz2 or .xz, - is stdout')
+    parser.add_argument('--write-chunk', type = int, default = 1 << 16,
+                        metavar = 'TOKENS',
+                        help = 'number of tokens joined into every write')
+    parser.add_argument('--interpret', action = 'store_true',
+                        help = 'match rules with the reference interpreter')
+    parser.add_argument('--memo', type = int, metavar = 'SIZE',
+                        help = 'cache up to SIZE labelled matcher results')
+    parser.add_argument('--rule-cache', metavar = 'DIR',
+                        help = 'keep parsed rules in DIR to skip parsing next time')
+    parser.add_argument('--regex-cache', type = int, metavar = 'SIZE',
+                        help = 'keep up to SIZE compiled regexes, print stats')
+    parser.add_argument('--stack', choices = ['tuple', 'array'],
+                        default = 'tuple',
+                        help = 'stack representation, array needs less ' +
+                               'memory when most tokens are pushed without ' +
+                               'being rewritten, and more when most are')
+    parser.add_argument('--loop-window', type = int, metavar = 'N',
+                        help = 'stop when rules cycle within N applications '
+                               'without reading input')
+    parser.add_argument('--prefetch', action = 'store_true',
+                        help = 'read the next block of input on a thread')
+    parser.add_argument('--serve', metavar = 'ADDRESS',
+                        help = 'serve the rules on HOST:PORT or a Unix socket path')
+    parser.add_argument('--step-budget', type = int, default = 1000,
+                        metavar = 'STEPS',
+                        help = 'steps a served session runs before the next one')
+    parser.add_argument('--max-steps', type = int, metavar = 'STEPS',
+                        help = 'drop served sessions after this many steps')
+    parser.add_argument('--show-stack', action = 'store_true',
+                        help = 'send served sessions their stack after every line')
+    parser.add_argument('--stream', action = 'store_true',
+                        help = 'write the output while input is still being read')
+    parser.add_argument('--isolate', action = 'store_true',
+                        help = 'run every infile on its own stack')
+    parser.add_argument('-j', '--jobs', type = int,
+                        help = 'number of worker processes for --isolate and --chunks')
+    parser.add_argument('--outdir',
+                        help = 'with --isolate, write one outfile per infile here')
+    parser.add_argument('--chunks', type = int, metavar = 'N',
+                        help = 'split every infile into N chunks run in parallel')
+    parser.add_argument('--profile', action = 'store_true',
+                        help = 'print per rule counters and timings to stderr')
+    parser.add_argument('--profile-json', type = argparse.FileType('w'),
+                        metavar = 'FILE', help = 'write the profile as JSON')
+    parser.add_argument('--metrics', action = 'store_true',
+                        help = 'count progress, dump it to stderr on SIGUSR1')
+    parser.add_argument('--metrics-file', metavar = 'FILE',
+                        help = 'keep the metrics in FILE, as Prometheus text '
+                               'if it ends in .prom, JSON if not')
+    parser.add_argument('--metrics-every', type = float, default = 10.0,
+                        metavar = 'SECONDS',
+                        help = 'how often to rewrite the metrics file')
+    parser.add_argument('--checkpoint', metavar = 'FILE',
+                        help = 'save progress to FILE to resume a failed run')
+    parser.add_argument('--checkpoint-every', type = float, default = 60.0,
+                        metavar = 'SECONDS',
+                        help = 'how often to save progress')
+    parser.add_argument('--resume', action = 'store_true',
+                        help = 'continue from the --checkpoint of an earlier run')
+    args = parser.parse_args(argv)
+    if args.loop_window and args.stack == 'array':
+        parser.error('--loop-window needs a tuple stack')
+    engine = Engine(interpret = args.interpret, memo = args.memo,
+                    stack = args.stack, regex_cache = args.regex_cache,
+                    cache_dir = args.rule_cache, loop_window = args.loop_window)
+    for sourcefile in args.source:
+        engine.load(sourcefile.read(), sourcefile.name)
+        close_file(sourcefile)
+    if args.loop_window and not engine.prepare().pure:
+        parser.error('--loop-window needs rules that never read builtin ' +
+                     'state with get')
+    seperator = args.seperator
+    profiler = None
+    if args.profile or args.profile_json:
+        if args.isolate or args.chunks:
+            parser.error('profiling needs a sequential run')
+        profiler = engine.profile()
+    metrics = None
+    if args.metrics or args.metrics_file:
+        if args.isolate or args.chunks or args.interactive or args.serve:
+            parser.error('metrics need a sequential batch run')
+        metrics = engine.monitor()
+        metrics.on_signal()
+        if args.metrics_file:
+            metrics.write_every(args.metrics_file, args.metrics_every)
+    checkpoint = None
+    if args.resume and not args.checkpoint:
+        parser.error('--resume needs a --checkpoint')
+    if args.checkpoint:
+        if (args.isolate or args.chunks or args.interactive or args.stream or
+                args.serve):
+            parser.error('checkpoints need a sequential batch run without --stream')
+        checkpoint = engine.checkpoint(args.checkpoint, args.infiles,
+                                       seperator, args.checkpoint_every)
+    if args.serve:
+        from server import Server
+        import asyncio
+        if args.interactive or args.isolate or args.chunks or args.stream:
+            parser.error('--serve runs on its own')
+        server = Server(engine, seperator or ' ', args.step_budget,
+                        args.max_steps, args.show_stack)
+        try:
+            asyncio.run(server.serve(args.serve))
+        except KeyboardInterrupt:
+            pass
+    elif args.interactive:
+        engine.interactive(seperator or ' ')
+    elif args.isolate:
+        from parallel import run_isolated, Collision
+        if args.stream:
+            parser.error('--stream can not be combined with --isolate')
+        if bool(args.outfile) == bool(args.outdir):
+            parser.error('--isolate needs one of --outfile or --outdir')
+        paths = args.infiles
+        outfile = args.outfile[0] if args.outfile else None
+        try:
+            run_isolated(engine, paths, seperator, args.jobs, outfile,
+                         args.outdir)
+        except Collision as err:
+            parser.error(str(err))
+        if outfile:
+            close_file(outfile)
+    else:
+        if not args.outfile:
+            parser.error('batch mode needs an --outfile')
+        outfile = args.outfile[0]
+        stream = None
+        if args.stream:
+            from analysis import Unbounded
+            try:
+                stream = engine.stream_writer(outfile, seperator,
+                                              args.write_chunk)
+            except Unbounded as err:
+                parser.error(f'cannot stream: {err}')
+        if args.chunks:
+            from parallel import run_chunked
+            from analysis import Unbounded
+            if args.stream:
+                parser.error('--stream can not be combined with --chunks')
+            try:
+                window = engine.chunk_window()
+            except Unbounded as err:
+                parser.error(f'cannot split input: {err}')
+            paths = args.infiles
+            if '-' in paths:
+                parser.error('stdin can not be split into chunks')
+            if any(compression(path) for path in paths):
+                parser.error('compressed input can not be split into chunks')
+            stack = run_chunked(engine, paths, seperator, window, args.chunks,
+                                args.jobs)
         else:
-            return next(self.base_gen)
-
-    def __iter__(self):
-        return self
+            engine.reset()
+            stack = pending = None
+            first = skip = 0
+            if args.resume:
+                saved = engine.resume()
+                if saved is None:
+                    print('no checkpoint to resume, starting over',
+                          file = sys.stderr)
+                else:
+                    stack, first, skip, pending = saved
+            for number in range(first, len(args.infiles)):
+                path = args.infiles[number]
+                counter = None
+                if metrics:
+                    metrics.reading(path)
+                    counter = metrics.read
+                if checkpoint:
+                    checkpoint.reading(number, skip)
+                with open_input(path) as infile:
+                    tokens = token_generator(infile, seperator, args.prefetch,
+                                             counter)
+                    if skip:
+                        tokens = islice(tokens, skip, None)
+                    stack = engine.run(tokens, stack, stream, pending)
+                skip, pending = 0, None
+                if engine.halted:
+                    break
+                if checkpoint:
+                    checkpoint.finished(number, stack)
+        if metrics:
+            metrics.finish()
+        if stream:
+            stream.finish(stack)
+        else:
+            write_stack(stack, outfile, seperator, args.write_chunk)
+        close_file(outfile)
+        if checkpoint:
+            checkpoint.remove()
+    if metrics:
+        metrics.stop()
+    if engine.memo:
+        print(engine.memo, file = sys.stderr)
+    if args.regex_cache:
+        print(engine.patterns, file = sys.stderr)
+    if profiler:
+        profiler.uninstall()
+        if args.profile:
+            print(profiler.report(), file = sys.stderr)
+        if args.profile_json:
+            profiler.dump(args.profile_json)
+            close_file(args.profile_json)
 
-def input_generator(seperator):
-    while True:
-        line = input()
-        for token in line.split(seperator):
-            yield token
-        
-def token_generator(file, sep):
-    if sep:
-        for line in file:
-            for token in line.split(sep):
-                yield token
-    else:
-        for line in file:
-            for char in line:
-                yield char
-    
-parser = argparse.ArgumentParser(description='Run the sessile stream processor')
-parser.add_argument('-i', '--interactive', action = 'store_true')
-parser.add_argument('source', type = argparse.FileType('r'), nargs = '*')
-parser.add_argument('-c', '--seperator', type = str, nargs = 1, default = '')
-parser.add_argument('-f', '--infiles', type = argparse.FileType('r'),
-                    nargs = '*')
-parser.add_argument('-o', '--outfile', type = argparse.FileType('w'),
-                    nargs = 1)
-args = parser.parse_args()
-patterns, rules = start_table, []
-for sourcefile in args.source:
-    new_patterns, new_rules = parse_rules(sourcefile.read(), patterns)
-    patterns.update(new_patterns)
-    rules += new_rules
-if args.interactive:
-    seperator = args.seperator if args.seperator else ' '
-    run_interactive(patterns, rules, seperator)
-else:
-    stack = None
-    seperator = args.seperator[0]
-    for infile in args.infiles:
-        stack = run_batch(patterns, rules, stack,
-                          token_generator(infile, seperator))
-        infile.close()
-    tokens = (token for token in
-              reversed(flatten(stack)))
-    outfile = args.outfile[0]
-    outfile.write(next(tokens))
-    for token in tokens:
-        outfile.write(seperator)
-        outfile.write(token)
-    outfile.flush()
-    outfile.close()
+if __name__ == '__main__':
+    try:
+        main()
+    except RewriteLoop as err:
+        sys.exit(f'error: {err}')
+    except BrokenPipeError:
+        # the reader went away, don't complain again when stdout is closed
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
@@ -0,0 +1,198 @@
+'''
+Reads input in large blocks and splits it into tokens in bulk.
+Tokens are split on the seperator within lines, a line's newline stays on
+its last token, and with an empty seperator every character is a token.
+Text is read with universal newlines.
+Files compressed with gzip, bzip2 or xz are read and written transparently.
+'''
+from queue import Queue, Full
+from sys import intern
+import codecs, importlib, io, mmap, os, sys, threading
+
+block_size = 1 << 20
+
+def _position(file):
+    try:
+        return file.buffer.tell()
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def _read_blocks(file, size, counter = None):
+    position = _position(file) if counter else None
+    while True:
+        block = file.read(size)
+        if not block:
+            return
+        if counter:
+            now = _position(file)
+            if now is None or position is None:
+                counter(len(block))
+            else:
+                counter(now - position)
+            position = now
+        yield block
+
+def _mapped_blocks(file, size, counter = None):
+    '''
+    Decodes file straight from a memory map, None if it can't be mapped
+    '''
+    try:
+        if (type(file) is not io.TextIOWrapper or
+                type(file.buffer) is not io.BufferedReader or file.tell() != 0):
+            return None
+        mapped = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        return None
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder(file.encoding)(file.errors), True)
+    def blocks():
+        with mapped, memoryview(mapped) as view:
+            for start in range(0, len(view), size):
+                if counter:
+                    counter(min(size, len(view) - start))
+                block = decoder.decode(view[start:start + size])
+                if block:
+                    yield block
+        block = decoder.decode(b'', final = True)
+        if block:
+            yield block
+    return blocks()
+
+_magic = [(b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'lzma')]
+_extensions = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'lzma', '.lzma': 'lzma'}
+
+def compression(path):
+    '''
+    Name of the module that decompresses path, going by its first bytes,
+    None if it isn't compressed
+    '''
+    with open(path, 'rb') as raw:
+        head = raw.read(6)
+    for magic, module in _magic:
+        if head.startswith(magic):
+            return module
+    return None
+
+def open_input(path, encoding = None):
+    '''
+    Opens path for reading text, decompressing it if needed, - is stdin
+    '''
+    if path == '-':
+        return sys.stdin
+    module = compression(path)
+    if module is None:
+        return open(path, encoding = encoding)
+    return importlib.import_module(module).open(path, 'rt', encoding = encoding)
+
+def open_output(path, encoding = None):
+    '''
+    Opens path for writing text, compressing it if its extension asks
+    for it, - is stdout
+    '''
+    if path == '-':
+        return sys.stdout
+    module = _extensions.get(os.path.splitext(path)[1].lower())
+    if module is None:
+        return open(path, 'w', encoding = encoding, buffering = block_size)
+    return importlib.import_module(module).open(path, 'wt', encoding = encoding)
+
+def close_file(file):
+    '''
+    Closes file, only flushing it if it is one of the standard streams
+    '''
+    if file in (sys.stdin, sys.stdout, sys.stderr):
+        file.flush()
+    else:
+        file.close()
+
+def text_blocks(file, size = None, counter = None):
+    '''
+    Yields the text of file in blocks of about size characters, decoded
+    from a memory map when file is a regular file that hasn't been read yet.
+    counter is called with the number of bytes behind every block, or of
+    characters where the bytes can't be told.
+    '''
+    size = size or block_size
+    blocks = _mapped_blocks(file, size, counter)
+    return _read_blocks(file, size, counter) if blocks is None else blocks
+
+def prefetch(blocks, depth = 2):
+    '''
+    Iterates blocks on a background thread, keeping up to depth blocks
+    ready ahead of the consumer
+    '''
+    queue = Queue(depth)
+    stop = threading.Event()
+    done = object()
+    def put(item):
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout = 0.1)
+                return True
+            except Full:
+                pass
+        return False
+    def produce():
+        try:
+            for block in blocks:
+                if not put(block):
+                    return
+            put(done)
+        except BaseException as err:
+            put(err)
+    thread = threading.Thread(target = produce, daemon = True)
+    thread.start()
+    try:
+        while True:
+            item = queue.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+def split_blocks(blocks, seperator):
+    '''
+    Splits text blocks into tokens. A seperator or newline may straddle two
+    blocks, so the unfinished last token of every block is carried over.
+    Putting a seperator after every newline splits a whole block at once.
+    '''
+    if not seperator:
+        for block in blocks:
+            yield from block
+        return
+    if '\n' in seperator:
+        yield from map(intern, _split_lines(blocks, seperator))
+        return
+    newline = '\n' + seperator
+    pending = text = ''
+    for block in blocks:
+        text = pending + block
+        tokens = text.replace('\n', newline).split(seperator)
+        pending = tokens.pop()
+        yield from map(intern, tokens)
+    if text and not text.endswith('\n'):
+        yield intern(pending)
+
+def _split_lines(blocks, seperator):
+    pending = ''
+    for block in blocks:
+        lines = (pending + block).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield from (line + '\n').split(seperator)
+    if pending:
+        yield from pending.split(seperator)
+
+def read_tokens(file, seperator, prefetched = False, size = None,
+                counter = None):
+    '''
+    Yields the tokens of file, reading the next block on a background
+    thread if prefetched is set, see text_blocks for counter
+    '''
+    blocks = text_blocks(file, size, counter)
+    if prefetched:
+        blocks = prefetch(blocks)
+    return split_blocks(blocks, seperator)
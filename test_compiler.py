@@ -0,0 +1,15 @@
+'''
+Compiled rules give the same results as the reference interpreter.
+'''
+from engine import Engine
+from linked_list import flatten
+import pytest
+
+cases = [('re(A, B) "m" -> A\n', ['a(.)c', 'abc', 'm']),
+         ('re(A, B) "m" -> A B\n', ['(a)(.)c', 'abc', 'm'])]
+
+@pytest.mark.parametrize('rules, tokens', cases)
+def test_compiled_matches_interpreter(rules, tokens):
+    compiled = Engine(rules).process(tokens)
+    interpreted = Engine(rules, interpret = True).process(tokens)
+    assert flatten(compiled) == flatten(interpreted)
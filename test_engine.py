@@ -0,0 +1,32 @@
+'''
+Engines keep the state of their builtins to themselves.
+'''
+from engine import Engine
+from linked_list import flatten
+import tokens
+
+rules = 'K V "s" -> set(K, V)\nget(A) "g" -> A\n'
+
+def test_state_is_per_engine():
+    first, second = Engine(rules), Engine(rules)
+    first.run(['k', '1', 's'])
+    assert flatten(first.run(['k', 'g'])) == ('1',)
+    assert flatten(second.run(['k', 'g'])) == ('g', 'k')
+    second.process(['k', '2', 's'])
+    assert flatten(first.run(['k', 'g'])) == ('1',)
+
+def test_state_per_caller():
+    engine = Engine(rules)
+    engine.run(['k', '1', 's'])
+    engine.use_state({})
+    assert flatten(engine.run(['k', 'g'])) == ('g', 'k')
+
+def test_regex_cache_is_per_engine(tmp_path):
+    size = tokens.patterns.size
+    # the second engine loads its rules from the cache the first stored
+    for target in ('ab', 'ac'):
+        engine = Engine('re(A) "m" -> A\n', regex_cache = 3,
+                        cache_dir = str(tmp_path))
+        assert flatten(engine.process(['a(.)', target, 'm'])) == (target[1],)
+        assert engine.patterns.size == 3 and engine.patterns.misses == 1
+    assert tokens.patterns.size == size
@@ -0,0 +1,59 @@
+'''
+Chunked runs give the same output as sequential ones, and isolated runs
+don't overwrite their own output.
+'''
+from engine import Engine, token_generator, write_stack
+from parallel import (run_chunked, run_isolated, split_file, output_paths,
+                      Collision)
+import io, pytest
+
+rules = '"zz" -> "y"\n'
+
+inputs = ['aaa\n bb\n', ' a\n  b\n c', 'a  b\n\n  \n', 'a b ', ' \n \n \n',
+          'x\n' * 50 + ' y\n' * 50]
+
+def output(stack):
+    out = io.StringIO()
+    write_stack(stack, out, ' ')
+    return out.getvalue()
+
+@pytest.mark.parametrize('text', inputs)
+@pytest.mark.parametrize('chunks', [2, 3, 7])
+def test_chunked_matches_sequential(tmp_path, text, chunks):
+    path = tmp_path / 'input.txt'
+    path.write_bytes(text.encode())
+    engine = Engine(rules)
+    with open(path) as infile:
+        sequential = output(engine.process(token_generator(infile, ' ')))
+    chunked = output(run_chunked(engine, [str(path)], ' ',
+                                 engine.chunk_window(), chunks, jobs = 2))
+    assert chunked == sequential
+
+def test_chunked_runs_rest_when_seam_never_settles(tmp_path):
+    # the carried "a" keeps every chunk's stack different beyond the probes
+    path = tmp_path / 'input.txt'
+    path.write_bytes(('a ' + ' '.join(f'x{i}' for i in range(2000))).encode())
+    engine = Engine('"a" X -> X "a"\n')
+    with open(path) as infile:
+        sequential = output(engine.process(token_generator(infile, ' ')))
+    chunked = output(run_chunked(engine, [str(path)], ' ',
+                                 engine.chunk_window(), 4, jobs = 2))
+    assert chunked == sequential
+
+def test_split_keeps_line_leading_seperator(tmp_path):
+    path = tmp_path / 'input.txt'
+    path.write_bytes(b'aaa\n bb\n')
+    assert split_file(str(path), ' ', 2) == [(0, 4), (4, 8)]
+
+def test_output_paths_refuse_same_basename():
+    assert output_paths(['a/x.txt', 'b/y.txt'], 'out') == ['out/x.txt',
+                                                           'out/y.txt']
+    with pytest.raises(Collision):
+        output_paths(['a/x.txt', 'b/x.txt'], 'out')
+
+def test_isolated_creates_outdir(tmp_path):
+    path = tmp_path / 'input.txt'
+    path.write_bytes(b'zz a')
+    outdir = tmp_path / 'out' / 'deep'
+    run_isolated(Engine(rules), [str(path)], ' ', 1, outdir = str(outdir))
+    assert (outdir / 'input.txt').read_text() == 'y a'
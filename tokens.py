@@ -0,0 +1,168 @@
+'''
+What builtins parse out of tokens, computed once per token.
+Results are kept in one bounded cache shared by every builtin, keyed on the
+kind of parse and the token, so a number tested by many rules is only
+converted once.
+'''
+from collections import OrderedDict
+import re
+
+operators = frozenset(['+', '-', '*', '/', '%', '^'])
+
+_missing = object()
+
+class TokenCache(object):
+    '''
+    Least recently used cache of parse results by (kind, token)
+    '''
+    def __init__(self, size = 65536, name = 'tokens'):
+        self.size = size
+        self.name = name
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, token, parse):
+        key = (kind, token)
+        entries = self.entries
+        value = entries.get(key, _missing)
+        if value is not _missing:
+            entries.move_to_end(key)
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = entries[key] = parse(token)
+        if len(entries) > self.size:
+            entries.popitem(last = False)
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0
+        return (f'{self.name}: {self.hits} hits, {self.misses} misses ' +
+                f'({rate:.1%}), {len(self.entries)}/{self.size} entries')
+
+cache = TokenCache()
+
+def _parse_int(token):
+    try:
+        return int(token)
+    except (ValueError, TypeError):
+        return None
+
+def _parse_float(token):
+    try:
+        return float(token)
+    except (ValueError, TypeError):
+        return None
+
+def _parse_rpn(expr, number):
+    ops = []
+    count = 0
+    for elem in expr.split(' '):
+        value = number(elem)
+        if value is not None:
+            ops.append(value)
+            count += 1
+        elif elem in operators:
+            ops.append(elem)
+            count -= 1
+        else:
+            return None
+        if count < 1:
+            return None
+    return tuple(ops) if count == 1 else None
+
+def as_int(token):
+    '''
+    Value of token as an int, None if it isn't one
+    '''
+    return cache.get('int', token, _parse_int)
+
+def as_float(token):
+    '''
+    Value of token as a float, None if it isn't one
+    '''
+    return cache.get('float', token, _parse_float)
+
+def as_rpn(token, f = False):
+    '''
+    Token as a valid space seperated RPN expression, a tuple of numbers and
+    operator strings, None if it isn't one
+    '''
+    if f:
+        return cache.get('rpnf', token, lambda t: _parse_rpn(t, as_float))
+    return cache.get('rpn', token, lambda t: _parse_rpn(t, as_int))
+
+_infix = {'+': '+', '-': '-', '*': '*', '/': '/', '%': '%', '^': '**'}
+
+def compile_rpn(shape, f = False):
+    '''
+    Compiles shape, an RPN expression with None for every number, into a
+    function of those numbers. Integer math floors on division and truncates
+    results of powers when they are used as operands, like int() would.
+    '''
+    names, terms = [], []
+    for op in shape:
+        if op is None:
+            names.append(f'x{len(names)}')
+            terms.append((names[-1], False))
+            continue
+        (b, b_pow), (a, a_pow) = terms.pop(), terms.pop()
+        if not f:
+            a, b = (f'int({a})' if a_pow else a), (f'int({b})' if b_pow else b)
+        infix = '//' if op == '/' and not f else _infix[op]
+        terms.append((f'({a} {infix} {b})', op == '^'))
+    [(body, _)] = terms
+    return eval(f'lambda {", ".join(names)}: {body}')
+
+evaluators = TokenCache(size = 1024, name = 'evaluators')
+
+def _evaluate(expr, f):
+    ops = as_rpn(expr, f)
+    if ops is None:
+        return None
+    shape = tuple(op if type(op) is str else None for op in ops)
+    evaluator = evaluators.get('rpnf' if f else 'rpn', shape,
+                               lambda shape: compile_rpn(shape, f))
+    return str(evaluator(*(op for op in ops if type(op) is not str)))
+
+def evaluate(expr, f = False):
+    '''
+    Result of the RPN expression expr as a string, None if expr isn't one.
+    Evaluators are compiled once per shape of expression, results are cached
+    like any other parse.
+    '''
+    if f:
+        return cache.get('evalf', expr, lambda t: _evaluate(t, True))
+    return cache.get('eval', expr, lambda t: _evaluate(t, False))
+
+patterns = TokenCache(size = 256, name = 'regex')
+
+def _compile(regex):
+    try:
+        return re.compile(regex)
+    except (re.error, TypeError):
+        return None
+
+def _fullmatch(key, compiled):
+    regex, target = key
+    pattern = compiled.get('re', regex, _compile)
+    if pattern is None:
+        return None
+    match = pattern.fullmatch(target)
+    return match.groups('') if match else None
+
+def fullmatch(regex, target, compiled = None):
+    '''
+    Groups of regex fully matching target, with '' for groups that took no
+    part, or None if it doesn't match or isn't a valid regex. Patterns are
+    compiled once into compiled, patterns by default, results are cached
+    per pair.
+    '''
+    compiled = patterns if compiled is None else compiled
+    return cache.get('re', (regex, target),
+                     lambda key: _fullmatch(key, compiled))